@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Acoustic echo cancellation so the mic can stay open while Sparky talks
+- Far-end reference: the exact PCM chunks handed to write_speakers()
+- Bulk echo delay found by GCC-PHAT cross-correlation, then a partitioned-block
+  frequency-domain NLMS filter models the room tail
+- Double-talk detection (residual vs. echo estimate) freezes adaptation and
+  signals barge-in once the filter has converged
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:  # voice-only installs may not have NumPy
+    np = None
+
+from ringbuf import PcmRing, DROP_OLDEST
+
+
+def available():
+    return np is not None
+
+
+def _db(energy):
+    return 10.0 * math.log10(energy + 1e-12)
+
+
+class EchoCanceller:
+    """Removes speaker echo from s16le mono mic chunks."""
+
+    def __init__(self, rate=24000, block_ms=10, tail_ms=200, max_delay_ms=500,
+                 mu=0.5, far_floor_db=-55.0, dt_margin_db=6.0, min_erle_db=10.0,
+                 delay_window_sec=1.0):
+        if np is None:
+            raise RuntimeError("EchoCanceller needs NumPy")
+        self.rate = rate
+        self.block = rate * block_ms // 1000
+        self.parts = max(1, math.ceil(tail_ms / block_ms))
+        self.max_delay = rate * max_delay_ms // 1000
+        self.mu = mu
+        self.far_floor_db = far_floor_db
+        self.dt_margin_db = dt_margin_db
+        self.min_erle_db = min_erle_db
+
+        # Reference FIFO: filled by far_end(), drained in step with the mic.
+        # It mirrors the sink queues, so the echo lag it leaves is roughly
+        # constant (pacat + parec latency) and the delay estimator finds it.
+        self._fifo = PcmRing(rate * 2 * 2, overflow=DROP_OLDEST)
+        self._win = int(rate * delay_window_sec)
+        self._hist = np.zeros(self.max_delay + self._win, dtype=np.float32)
+        self.delay = 0
+
+        n, m = self.block, 2 * self.block
+        self._x_prev = np.zeros(n, dtype=np.float32)
+        self._xf = np.zeros((self.parts, n + 1), dtype=np.complex64)
+        self._w = np.zeros((self.parts, n + 1), dtype=np.complex64)
+        self._pw = np.full(n + 1, 1e-3, dtype=np.float32)
+        self._eps = m * 1e-6
+        self._zeros = np.zeros(n, dtype=np.float32)
+
+        self._dmic = []
+        self._dlen = 0
+        self._dactive = 0
+
+        self._dt_ratio = 10.0 ** (-dt_margin_db / 10.0)
+        self._dt_hold = 0
+        self._converged = False
+
+        self.far_active = False
+        self.double_talk = False
+        self.erle_db = 0.0
+        self.echo_db = -120.0
+        self.residual_db = -120.0
+        self.delay_updates = 0
+        self.resets = 0
+
+    # --- Far end ---
+
+    def far_end(self, pcm):
+        """Record PCM exactly as it was handed to the speakers."""
+        self._fifo.write(pcm)
+
+    def flush_far_end(self):
+        """Playback was cancelled; the queued reference will never be heard."""
+        self._fifo.clear()
+
+    # --- Near end ---
+
+    def process(self, pcm):
+        """Cancel echo from one mic chunk; returns cleaned s16le bytes."""
+        d = np.frombuffer(pcm, dtype="<i2").astype(np.float32) / 32768.0
+        n = len(d)
+        if n % self.block:
+            raise ValueError(f"chunk of {n} samples is not a multiple of {self.block}")
+
+        raw = self._fifo.read(n * 2)
+        ref = np.zeros(n, dtype=np.float32)
+        if len(raw):
+            ref[:len(raw) // 2] = np.frombuffer(raw, dtype="<i2") / 32768.0
+        self._hist[:-n] = self._hist[n:]
+        self._hist[-n:] = ref
+
+        end = len(self._hist) - self.delay
+        x = self._hist[end - n:end]
+        # Echo keeps arriving for delay + tail after the reference goes quiet
+        span = self._hist[max(0, end - n - self.parts * self.block):]
+        self.far_active = _db(float(np.mean(span * span))) > self.far_floor_db
+        self._track_delay(d)
+
+        adapt = self.far_active and not self._dt_hold
+        e = np.empty(n, dtype=np.float32)
+        y = np.empty(n, dtype=np.float32)
+        for i in range(0, n, self.block):
+            y[i:i + self.block], e[i:i + self.block] = self._block(
+                x[i:i + self.block], d[i:i + self.block], adapt)
+
+        d_e, y_e, e_e = float(np.mean(d * d)), float(np.mean(y * y)), float(np.mean(e * e))
+        self.echo_db, self.residual_db = _db(y_e), _db(e_e)
+        if e_e > 2.0 * d_e and _db(d_e) > self.far_floor_db:
+            self._reset_filter()  # diverged: output louder than input
+        self.double_talk = (self.far_active and self._converged
+                            and self.residual_db > self.echo_db - self.dt_margin_db
+                            and self.residual_db > self.far_floor_db)
+        if self.double_talk:
+            self._dt_hold = 3
+        elif self._dt_hold:
+            self._dt_hold -= 1
+        elif self.far_active:
+            self.erle_db += 0.1 * (_db(d_e) - self.residual_db - self.erle_db)
+        self._converged = self.erle_db >= self.min_erle_db
+
+        return (np.clip(e, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+    def _block(self, x, d, adapt):
+        n = self.block
+        X = np.fft.rfft(np.concatenate((self._x_prev, x)))
+        self._x_prev = x.copy()
+        self._xf[1:] = self._xf[:-1]
+        self._xf[0] = X
+        y = np.fft.irfft((self._xf * self._w).sum(axis=0), 2 * n)[n:]
+        e = d - y
+        if adapt and self._converged and float(e @ e) > float(y @ y) * self._dt_ratio:
+            adapt = False  # near-end energy in this block; don't learn from it
+        if adapt:
+            E = np.fft.rfft(np.concatenate((self._zeros, e)))
+            self._pw = 0.9 * self._pw + 0.1 * (X.real ** 2 + X.imag ** 2)
+            G = (self.mu / self.parts) * np.conj(self._xf) * (E / (self._pw + self._eps))
+            # Gradient constraint: keep each partition a linear (not circular) filter
+            g = np.fft.irfft(G, 2 * n, axis=1)
+            g[:, n:] = 0.0
+            self._w += np.fft.rfft(g, axis=1).astype(np.complex64)
+        return y, e
+
+    # --- Bulk delay ---
+
+    def _track_delay(self, d):
+        # The window must be contiguous with the reference history, so every
+        # chunk goes in; it is only evaluated if the far end was mostly active.
+        self._dmic.append(d)
+        self._dlen += len(d)
+        self._dactive += self.far_active
+        if self._dlen < self._win:
+            return
+        mic = np.concatenate(self._dmic)
+        active = self._dactive * 2 >= len(self._dmic)
+        # Reference covering the same span plus max_delay of history before it
+        span = self._dlen + self.max_delay
+        refw = self._hist[-span:]
+        self._dmic, self._dlen, self._dactive = [], 0, 0
+        if not active:
+            return
+
+        size = 1 << (span + len(mic)).bit_length()
+        R = np.fft.rfft(refw, size) * np.conj(np.fft.rfft(mic, size))
+        cc = np.fft.irfft(R / (np.abs(R) + 1e-9), size)
+        # mic[t] ~ ref[t - lag]; refw starts max_delay samples before mic,
+        # so the echo peak sits at cc[max_delay - lag]
+        lags = cc[:self.max_delay + 1][::-1]
+        lag = int(np.argmax(lags))
+        if lags[lag] < 6.0 * float(np.mean(np.abs(lags))):
+            return  # no clear echo peak (e.g. near-end talking)
+        # Leave a little room before the main tap
+        delay = max(0, lag - self.block)
+        if abs(delay - self.delay) > self.block * 2:
+            self.delay = delay
+            self.delay_updates += 1
+            self._reset_filter()
+
+    def _reset_filter(self):
+        self._w[:] = 0
+        self._xf[:] = 0
+        self.erle_db = 0.0
+        self._converged = False
+        self._dt_hold = 0
+        self.resets += 1
+
+    def stats(self):
+        return {
+            "delay_ms": round(1000.0 * self.delay / self.rate),
+            "erle_db": round(self.erle_db, 1),
+            "far_active": self.far_active,
+            "double_talk": self.double_talk,
+            "delay_updates": self.delay_updates,
+            "resets": self.resets,
+        }
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Audio pipeline benchmark - runs g1_sparky.main() against synthetic endpoints
+- Mock Realtime server in-process streaming synthetic replies in bursts
+- parec/pacat replaced by the replay.py stand-ins (real pipes, real time)
+- Varies sink count, delta burst size and extra event-loop load
+- Reports CPU per audio-second, end-to-end chunk latency, write jitter,
+  underruns and peak audio_buf; saves JSON for comparing versions
+
+  python bench_audio.py --sinks 1,2 --burst-ms 50,500 --load-ms 0,20
+  python bench_audio.py --quick --compare old.json
+"""
+
+import argparse
+import asyncio
+import base64
+import bisect
+import contextlib
+import io
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import g1_sparky
+import session
+import playout
+import ringbuf
+from latency import percentile
+
+AUDIO_RATE = g1_sparky.AUDIO_RATE
+BYTES_PER_SEC = AUDIO_RATE * g1_sparky.S16LE_BYTES
+
+
+# --- Instrumented versions of what main() builds ---
+
+class Probe:
+    """Collects what the instrumented classes observe during one run."""
+
+    def __init__(self):
+        self.rings = []
+        self.schedulers = []
+        self.writes = []           # (sink, item_id, offset_end, t)
+        self.played = {}           # (sink, item_id) -> bytes
+
+
+PROBE = Probe()
+
+
+class PeakRing(ringbuf.PcmRing):
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.peak = 0
+        PROBE.rings.append(self)
+
+    def write(self, data):
+        dropped = super().write(data)
+        if len(self) > self.peak:
+            self.peak = len(self)
+        return dropped
+
+
+class ProbeScheduler(playout.PlayoutScheduler):
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        PROBE.schedulers.append(self)
+
+
+class ProbeTracker(playout.PlaybackTracker):
+    def played(self, sink, tag):
+        t = time.monotonic()
+        for item_id, n in tag:
+            key = (sink, item_id)
+            PROBE.played[key] = PROBE.played.get(key, 0) + n
+            PROBE.writes.append((sink, item_id, PROBE.played[key], t))
+        super().played(sink, tag)
+
+
+# --- Synthetic session ---
+
+def make_session(turns, reply_sec, burst_ms, stream_rate):
+    """Server events as (t, item_id, offset_end, raw); offset_end None for non-audio."""
+    burst = BYTES_PER_SEC * burst_ms // 1000
+    burst -= burst % 2
+    pcm = bytes(BYTES_PER_SEC * reply_sec)   # silence is fine; content is not measured
+    events = []
+    t = 0.5
+    for n in range(turns):
+        item_id = f"bench_item_{n}"
+
+        def add(ev, off=None):
+            events.append((t, item_id if off is not None else None, off, json.dumps(ev)))
+
+        add({"type": "input_audio_buffer.speech_started"})
+        t += 1.0
+        add({"type": "input_audio_buffer.speech_stopped"})
+        t += 0.3
+        add({"type": "response.created"})
+        t += 0.2
+        for off in range(0, len(pcm), burst):
+            piece = pcm[off:off + burst]
+            add({"type": "response.audio.delta", "item_id": item_id,
+                 "delta": base64.b64encode(piece).decode()}, off + len(piece))
+            t += len(piece) / BYTES_PER_SEC / stream_rate
+        add({"type": "response.audio.done"})
+        add({"type": "response.done"})
+        # Let the reply play out (plus the half-duplex reopen) before the next turn
+        t += reply_sec + 2.5
+    return events, len(pcm) * turns
+
+
+# --- One scenario ---
+
+async def run_scenario(sinks, burst_ms, load_ms, turns, reply_sec, stream_rate, replay_dir):
+    global PROBE
+    PROBE = Probe()
+    events, total = make_session(turns, reply_sec, burst_ms, stream_rate)
+    sent_at = {}            # item_id -> ([offset_end], [t])
+    done = asyncio.Event()
+    uploads = [0]
+
+    async def handler(conn):
+        async def drain():
+            async for raw in conn:
+                if '"input_audio_buffer.append"' in raw[:64]:
+                    uploads[0] += 1
+        client = asyncio.create_task(drain())
+        t0 = time.monotonic()
+        for t, item_id, off, raw in events:
+            delay = t - (time.monotonic() - t0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await conn.send(raw)
+            if off is not None:
+                offs, ts = sent_at.setdefault(item_id, ([], []))
+                offs.append(off)
+                ts.append(time.monotonic())
+        done.set()
+        try:
+            await client
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    stop_load = False
+    burned = [0.0]
+
+    async def loop_load():
+        # Blocks the event loop for load_ms every 100ms, like an inline encode
+        # would; its own CPU is taken out of the result
+        while not stop_load:
+            await asyncio.sleep(0.1)
+            c0 = time.process_time()
+            end = time.perf_counter() + load_ms / 1000.0
+            while time.perf_counter() < end:
+                pass
+            burned[0] += time.process_time() - c0
+
+    async with websockets.serve(handler, "127.0.0.1", 0, max_size=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        g1_sparky.REALTIME_URL = f"ws://127.0.0.1:{port}/v1/realtime"
+        g1_sparky.REPLAY_SINKS = sinks
+        cpu0, wall0 = time.process_time(), time.monotonic()
+        load = asyncio.create_task(loop_load()) if load_ms else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            app = asyncio.create_task(g1_sparky.main())
+            await done.wait()
+            # Wait until every sink has had the whole session written to it
+            deadline = time.monotonic() + 10 + reply_sec
+            while time.monotonic() < deadline:
+                if sum(PROBE.played.values()) >= total * sinks:
+                    break
+                await asyncio.sleep(0.1)
+            app.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await app
+        stop_load = True
+        if load:
+            await load
+        cpu, wall = time.process_time() - cpu0 - burned[0], time.monotonic() - wall0
+
+    # End-to-end latency: server send of the delta carrying a chunk's last
+    # byte -> that chunk written to a sink pipe
+    lat, gaps = [], []
+    last = {}
+    for sink, item_id, off, t in PROBE.writes:
+        offs, ts = sent_at.get(item_id, ([], []))
+        k = bisect.bisect_left(offs, off)
+        if k < len(offs):
+            lat.append((t - ts[k]) * 1000.0)
+        prev = last.get((sink, item_id))
+        if prev is not None:
+            gaps.append((t - prev) * 1000.0)
+        last[(sink, item_id)] = t
+    lat.sort()
+    audio_sec = total / BYTES_PER_SEC
+    played = sum(PROBE.played.values()) / max(1, sinks)
+    return {
+        "sinks": sinks,
+        "burst_ms": burst_ms,
+        "load_ms": load_ms,
+        "audio_sec": audio_sec,
+        "played_ratio": round(played / total, 3) if total else 0.0,
+        "cpu_ms_per_audio_sec": round(cpu * 1000.0 / audio_sec, 2),
+        "cpu_util": round(cpu / wall, 3),
+        "latency_ms": {
+            "p50": _r(percentile(lat, 50)),
+            "p95": _r(percentile(lat, 95)),
+            "p99": _r(percentile(lat, 99)),
+            "max": _r(lat[-1] if lat else None),
+        },
+        "write_jitter_ms": _r(statistics.pstdev(gaps) if len(gaps) > 1 else None),
+        "underruns": sum(s.underruns for s in PROBE.schedulers),
+        "overruns": sum(s.overruns for s in PROBE.schedulers),
+        "peak_audio_buf_ms": max((r.peak * 1000 // BYTES_PER_SEC for r in PROBE.rings
+                                  if r.capacity == g1_sparky.AUDIO_BUF_MAX_BYTES), default=0),
+        "mic_uploads": uploads[0],
+    }
+
+
+def _r(v):
+    return None if v is None else round(v, 1)
+
+
+# --- Driver ---
+
+def version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def key(r):
+    return (r["sinks"], r["burst_ms"], r["load_ms"])
+
+
+def compare(results, old_path):
+    with open(old_path) as f:
+        old = {key(r): r for r in json.load(f)["results"]}
+    print(f"\nvs {old_path}:")
+    for r in results:
+        o = old.get(key(r))
+        if not o:
+            continue
+        print(f"  sinks={r['sinks']} burst={r['burst_ms']}ms load={r['load_ms']}ms: "
+              f"cpu {o['cpu_ms_per_audio_sec']} -> {r['cpu_ms_per_audio_sec']} ms/s, "
+              f"p95 {o['latency_ms']['p95']} -> {r['latency_ms']['p95']} ms, "
+              f"underruns {o['underruns']} -> {r['underruns']}")
+
+
+def ints(s):
+    return [int(x) for x in s.split(",") if x]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the g1_sparky audio pipeline")
+    ap.add_argument("--sinks", type=ints, default=[1, 2])
+    ap.add_argument("--burst-ms", type=ints, default=[50, 500])
+    ap.add_argument("--load-ms", type=ints, default=[0, 20])
+    ap.add_argument("--turns", type=int, default=3)
+    ap.add_argument("--reply-sec", type=int, default=3)
+    ap.add_argument("--stream-rate", type=float, default=4.0,
+                    help="how much faster than real time the server streams replies")
+    ap.add_argument("--half-duplex", action="store_true")
+    ap.add_argument("--quick", action="store_true", help="one 1-sink scenario")
+    ap.add_argument("--out", default="bench_audio.json")
+    ap.add_argument("--compare", help="previous results JSON to diff against")
+    args = ap.parse_args()
+    if args.quick:
+        args.sinks, args.burst_ms, args.load_ms, args.turns = [1], [200], [0], 2
+
+    # Point main() at the synthetic endpoints and the instrumented classes
+    replay_dir = tempfile.mkdtemp(prefix="sparky-bench-")
+    with open(os.path.join(replay_dir, "mic.pcm"), "wb") as f:
+        f.write(bytes(BYTES_PER_SEC))
+    g1_sparky.REPLAY_DIR = replay_dir
+    g1_sparky.LATENCY_LOG = None
+    g1_sparky.PHRASE_CACHE_DIR = None
+    g1_sparky.FULL_DUPLEX = not args.half_duplex
+    session.PcmRing = PeakRing
+    session.PlayoutScheduler = ProbeScheduler
+    session.PlaybackTracker = ProbeTracker
+
+    results = []
+    for sinks, burst, load in itertools.product(args.sinks, args.burst_ms, args.load_ms):
+        r = asyncio.run(run_scenario(sinks, burst, load, args.turns, args.reply_sec,
+                                     args.stream_rate, replay_dir))
+        results.append(r)
+        lat = r["latency_ms"]
+        print(f"sinks={sinks} burst={burst}ms load={load}ms: "
+              f"cpu={r['cpu_ms_per_audio_sec']}ms/audio-s latency p50/p95={lat['p50']}/{lat['p95']}ms "
+              f"jitter={r['write_jitter_ms']}ms underruns={r['underruns']} "
+              f"peak_buf={r['peak_audio_buf_ms']}ms played={r['played_ratio']:.0%}")
+
+    out = {"version": version(), "ts": round(time.time()), "args": vars(args), "results": results}
+    with open(args.out, "w") as f:
+        json.dump(out, f, indent=2)
+    print(f"Saved {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
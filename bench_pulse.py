@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Audio backend benchmark - pacat/parec subprocesses vs. in-process libpulse
+- Plays the same real-time chunk stream to each sink through SpeakerFanout
+  and captures from the mic source, once per backend
+- Reports startup time, CPU per audio-second (this process plus its
+  pacat/parec children), write time, sink latency and underflows
+- Needs a running PulseAudio; a null sink works without speakers:
+  pactl load-module module-null-sink sink_name=bench
+
+  python bench_pulse.py --sinks bench,bench --seconds 20
+  python bench_pulse.py --compare old.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import pulse
+from mic import MicStream
+from speakers import SpeakerFanout, find_usb_sinks, spawn_pacat
+
+AUDIO_RATE = 24000
+BYTES_PER_SEC = AUDIO_RATE * 2
+CHUNK_BYTES = BYTES_PER_SEC // 20      # 50ms, like the playout feeder
+MIC_CHUNK_BYTES = BYTES_PER_SEC // 10  # 100ms, like MicUplink
+
+
+def cpu_now():
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def spawn_parec(source):
+    return subprocess.Popen(
+        ["parec", "--device", source, "--format=s16le", "--channels=1",
+         f"--rate={AUDIO_RATE}", "--latency-msec=100"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def available(backend):
+    if backend == "libpulse":
+        return pulse.available()
+    return bool(shutil.which("pacat") and shutil.which("parec"))
+
+
+async def run_backend(backend, sinks, source, seconds):
+    spawn = pulse.spawn_playback if backend == "libpulse" else spawn_pacat
+    cpu0 = cpu_now()
+
+    t0 = time.monotonic()
+    speakers = SpeakerFanout(sinks, spawn=spawn)
+    speakers.start()
+    if backend == "libpulse":
+        rec = pulse.PulseRecord(source, AUDIO_RATE)
+    else:
+        rec = spawn_parec(source)
+    mic = MicStream(rec.stdout, MIC_CHUNK_BYTES, BYTES_PER_SEC)
+    mic.start()
+    first = await mic.read()
+    startup_ms = (time.monotonic() - t0) * 1000.0
+
+    async def play():
+        chunk = bytes(CHUNK_BYTES)
+        start = time.monotonic()
+        for n in range(seconds * 20):
+            speakers.write(chunk)
+            delay = start + (n + 1) / 20 - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def capture():
+        got = 0 if first is None else len(first)
+        while got < seconds * BYTES_PER_SEC:
+            data = await mic.read()
+            if data is None:
+                break
+            got += len(data)
+        return got
+
+    t1 = time.monotonic()
+    _, captured = await asyncio.gather(play(), capture())
+    await asyncio.sleep(0.3)
+    wall = time.monotonic() - t1
+    stats = speakers.stats()
+
+    mic.close()
+    rec.kill()
+    rec.wait()
+    speakers.stop()
+    for w in speakers.writers:
+        w._proc.wait()
+    cpu = cpu_now() - cpu0
+
+    audio_sec = seconds * len(sinks) + captured / BYTES_PER_SEC
+    lat = [s["latency_ms"] for s in stats.values() if s["latency_ms"] is not None]
+    return {
+        "backend": backend,
+        "sinks": len(sinks),
+        "seconds": seconds,
+        "startup_ms": round(startup_ms, 1),
+        "cpu_ms_per_audio_sec": round(cpu * 1000.0 / max(audio_sec, 1e-6), 2),
+        "cpu_util": round(cpu / wall, 3),
+        "write_ms": round(max(s["write_ms"] for s in stats.values()), 2),
+        "write_ms_max": round(max(s["write_ms_max"] for s in stats.values()), 2),
+        "latency_ms": round(max(lat), 1) if lat else None,
+        "underflows": sum(s["underflows"] for s in stats.values()),
+        "dropped": sum(s["dropped"] for s in stats.values()),
+        "respawns": sum(s["respawns"] for s in stats.values()),
+        "mic_sec": round(captured / BYTES_PER_SEC, 2),
+    }
+
+
+def compare(results, old_path):
+    with open(old_path) as f:
+        old = {(r["backend"], r["sinks"]): r for r in json.load(f)["results"]}
+    print(f"\nvs {old_path}:")
+    for r in results:
+        o = old.get((r["backend"], r["sinks"]))
+        if o:
+            print(f"  {r['backend']} sinks={r['sinks']}: "
+                  f"cpu {o['cpu_ms_per_audio_sec']} -> {r['cpu_ms_per_audio_sec']} ms/s, "
+                  f"startup {o['startup_ms']} -> {r['startup_ms']} ms, "
+                  f"underflows {o['underflows']} -> {r['underflows']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the pacat/parec and libpulse backends")
+    ap.add_argument("--backends", default="subprocess,libpulse")
+    ap.add_argument("--sinks", help="comma-separated sink names (default: the USB sinks)")
+    ap.add_argument("--source", default="@DEFAULT_SOURCE@")
+    ap.add_argument("--seconds", type=int, default=10)
+    ap.add_argument("--out", default="bench_pulse.json")
+    ap.add_argument("--compare", help="previous results JSON to diff against")
+    args = ap.parse_args()
+
+    sinks = args.sinks.split(",") if args.sinks else find_usb_sinks()
+    if not sinks:
+        print("ERROR: no sinks (pass --sinks)")
+        return
+    results = []
+    for backend in args.backends.split(","):
+        if not available(backend):
+            print(f"{backend}: not available, skipped")
+            continue
+        r = asyncio.run(run_backend(backend, sinks, args.source, args.seconds))
+        results.append(r)
+        print(f"{backend} sinks={r['sinks']}: startup={r['startup_ms']}ms "
+              f"cpu={r['cpu_ms_per_audio_sec']}ms/audio-s write={r['write_ms']}ms "
+              f"max={r['write_ms_max']}ms latency={r['latency_ms']}ms "
+              f"underflows={r['underflows']} dropped={r['dropped']}")
+
+    with open(args.out, "w") as f:
+        json.dump({"ts": round(time.time()), "args": vars(args), "results": results}, f, indent=2)
+    print(f"Saved {args.out}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+On-demand webcam capture
+- A grab thread keeps the V4L2 queue fresh with cap.grab(): no decode
+- snapshot() retrieves the newest frame only when it is actually needed
+- With native MJPEG the camera's own JPEG is kept as-is, so it can go to
+  the API without a decode/re-encode; scene checks use a 1/8-scale
+  grayscale decode straight from the DCT
+- grab(), retrieve() and release() share a lock; nothing else touches the
+  capture
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+_REDUCED_GRAY = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def _is_jpeg(buf):
+    return buf is not None and buf.ndim == 1 and len(buf) > 4 and buf[0] == 0xFF and buf[1] == 0xD8
+
+
+def _has_huffman_tables(jpeg):
+    # Many UVC cameras emit "MJPEG" without DHT segments; those frames need
+    # libjpeg's default tables, so they are decoded and re-encoded instead
+    head = jpeg[:4096].tobytes() if isinstance(jpeg, np.ndarray) else jpeg[:4096]
+    return b"\xff\xc4" in head
+
+
+class Snapshot:
+    """One retrieved frame: the camera's JPEG bytes, a BGR image, or both."""
+
+    def __init__(self, jpeg=None, image=None):
+        self.jpeg = jpeg
+        self._image = image
+
+    @property
+    def image(self):
+        if self._image is None and self.jpeg is not None:
+            self._image = cv2.imdecode(np.frombuffer(self.jpeg, np.uint8), cv2.IMREAD_COLOR)
+        return self._image
+
+    @property
+    def decoded(self):
+        return self._image is not None
+
+    def gray(self, reduce=8):
+        """Grayscale at 1/reduce scale (2, 4 or 8); JPEG frames decode straight to it."""
+        if self._image is None and self.jpeg is not None:
+            return cv2.imdecode(np.frombuffer(self.jpeg, np.uint8), _REDUCED_GRAY[reduce])
+        img = self._image
+        if img is None:
+            return None
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        h, w = img.shape[:2]
+        return cv2.resize(img, (w // reduce, h // reduce), interpolation=cv2.INTER_AREA)
+
+    def thumbnail(self):
+        """Small grayscale image for change detection; cheap for JPEG frames."""
+        return self.gray(8)
+
+
+class Camera:
+    """USB webcam that only decodes the frames someone asks for."""
+
+    def __init__(self, device, width, height, mjpeg=True):
+        self.device = device
+        self.width = width
+        self.height = height
+        self._want_mjpeg = mjpeg
+        self._cap = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._fresh = False      # a frame was grabbed since the last retrieve()
+        self.passthrough = False
+
+        self.grabs = 0
+        self.retrieves = 0
+        self.failures = 0
+
+    def open(self):
+        cap = cv2.VideoCapture(self.device, cv2.CAP_V4L2)
+        if self._want_mjpeg:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if not cap.isOpened():
+            return False
+        self._cap = cap
+        if self._want_mjpeg and self._fourcc() == "MJPG":
+            # Ask for the undecoded buffer; keep it only if it really is a
+            # self-contained JPEG
+            cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            cap.grab()
+            ok, buf = cap.retrieve()
+            if ok and _is_jpeg(buf) and _has_huffman_tables(buf):
+                self.passthrough = True
+            else:
+                cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        # Warmup frames (auto exposure)
+        for _ in range(10):
+            cap.grab()
+        return True
+
+    def _fourcc(self):
+        v = int(self._cap.get(cv2.CAP_PROP_FOURCC))
+        return "".join(chr((v >> (8 * i)) & 0xFF) for i in range(4))
+
+    @property
+    def size(self):
+        return (int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def describe(self):
+        w, h = self.size
+        mode = "MJPEG passthrough" if self.passthrough else f"{self._fourcc()} decoded"
+        return f"{w}x{h} {mode}"
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="camera-grab", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                if self._cap is None:
+                    break
+                ok = self._cap.grab()
+                if ok:
+                    self.grabs += 1
+                    self._fresh = True
+            if not ok:
+                self.failures += 1
+                time.sleep(0.1)
+            # grab() blocks until the camera delivers, which paces this loop;
+            # the yield lets snapshot() take the lock between frames
+            time.sleep(0)
+
+    def snapshot(self):
+        """Retrieve the most recently grabbed frame, or None."""
+        with self._lock:
+            if not self._fresh or self._cap is None:
+                return None
+            ok, buf = self._cap.retrieve()
+            self._fresh = False
+            self.retrieves += 1
+        if not ok or buf is None:
+            self.failures += 1
+            return None
+        if self.passthrough:
+            if not _is_jpeg(buf):
+                self.failures += 1
+                return None
+            return Snapshot(jpeg=buf.tobytes())
+        return Snapshot(image=buf)
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1.0)
+        # A frame worker may still be inside snapshot() (the pool is shut
+        # down without waiting): release only between its calls
+        with self._lock:
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
+
+    def stats(self):
+        return {
+            "grabs": self.grabs,
+            "retrieves": self.retrieves,
+            "failures": self.failures,
+            "passthrough": self.passthrough,
+        }
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Bounded server-side conversation context
+- Tracks every item the session adds (conversation.item.created) with a
+  token estimate: images from the frame encoder, user audio from the server
+  VAD speech span, replies from response.done usage
+- Instructions/tool overhead is whatever the server's input_tokens count
+  has on top of the items, re-measured at every response.done
+- Retention: keep the last max_images frames, and drop the oldest items
+  while the estimate is over max_tokens; the newest keep_items always stay
+- clear() for when a visitor leaves, so the next one starts fresh
+"""
+
+from collections import OrderedDict
+
+AUDIO_IN_TOKENS_PER_SEC = 10   # rough input audio token rate
+
+
+class ContextWindow:
+    """Chooses which conversation items to conversation.item.delete."""
+
+    def __init__(self, max_images=3, max_tokens=16000, keep_items=4):
+        self.max_images = max_images
+        self.max_tokens = max_tokens
+        self.keep_items = keep_items
+        self._items = OrderedDict()    # item_id -> [kind, tokens]
+        self._pending = {}             # item_id -> tokens known before created
+        self._speech = {}              # item_id -> audio_start_ms
+        self._base = 0                 # instructions etc. (from usage)
+        self.input_tokens = 0          # server's count at the last response
+        self.deleted = 0
+
+    # --- Item bookkeeping ---
+
+    def expect(self, item_id, tokens):
+        """We are about to create item_id (e.g. an image) worth ~tokens."""
+        self._pending[item_id] = tokens
+
+    def unexpect(self, item_id):
+        """item_id was never sent after all."""
+        self._pending.pop(item_id, None)
+
+    def created(self, item):
+        item_id = item.get("id")
+        if not item_id:
+            return
+        content = item.get("content") or []
+        if any(c.get("type") == "input_image" for c in content):
+            kind = "image"
+        else:
+            kind = item.get("role") or item.get("type") or "other"
+        self._items[item_id] = [kind, self._pending.pop(item_id, 0)]
+
+    def speech_started(self, item_id, audio_start_ms):
+        if item_id and audio_start_ms is not None:
+            self._speech[item_id] = audio_start_ms
+
+    def speech_stopped(self, item_id, audio_end_ms):
+        start = self._speech.pop(item_id, None)
+        if start is None or audio_end_ms is None:
+            return
+        tokens = int((audio_end_ms - start) / 1000.0 * AUDIO_IN_TOKENS_PER_SEC)
+        if item_id in self._items:
+            self._items[item_id][1] = tokens
+        else:
+            self._pending[item_id] = tokens
+
+    def response_done(self, response):
+        usage = response.get("usage") or {}
+        outputs = [o.get("id") for o in response.get("output") or [] if o.get("id")]
+        if "input_tokens" in usage:
+            self.input_tokens = usage["input_tokens"]
+            prior = sum(v[1] for k, v in self._items.items() if k not in outputs)
+            self._base = max(0, self.input_tokens - prior)
+        out = usage.get("output_tokens", 0)
+        for item_id in outputs:
+            if item_id in self._items:
+                self._items[item_id][1] = out // len(outputs)
+
+    def removed(self, item_id):
+        """conversation.item.deleted from the server (or a delete we sent)."""
+        self._items.pop(item_id, None)
+
+    # --- Retention ---
+
+    @property
+    def tokens(self):
+        return self._base + sum(v[1] for v in self._items.values())
+
+    def evict(self):
+        """Item ids to delete now; they are dropped from tracking."""
+        ids = list(self._items)
+        victims = []
+        images = [i for i in ids if self._items[i][0] == "image"]
+        if len(images) > self.max_images:
+            victims.extend(images[:len(images) - self.max_images])
+        over = self.tokens - self.max_tokens - sum(self._items[i][1] for i in victims)
+        for item_id in ids[:max(0, len(ids) - self.keep_items)]:
+            if over <= 0:
+                break
+            if item_id not in victims:
+                victims.append(item_id)
+                over -= self._items[item_id][1]
+        for item_id in victims:
+            self._items.pop(item_id)
+        self.deleted += len(victims)
+        return victims
+
+    def clear(self):
+        """Everything, e.g. after the visitor walked away."""
+        victims = list(self._items)
+        self._items.clear()
+        self._pending.clear()
+        self._speech.clear()
+        self.deleted += len(victims)
+        return victims
+
+    def stats(self):
+        kinds = {}
+        for kind, _ in self._items.values():
+            kinds[kind] = kinds.get(kind, 0) + 1
+        return {
+            "items": len(self._items),
+            "images": kinds.get("image", 0),
+            "turns": len(self._items) - kinds.get("image", 0),
+            "tokens": self.tokens,
+            "input_tokens": self.input_tokens,
+            "deleted": self.deleted,
+        }
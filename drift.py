@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Per-sink clock drift: each USB DAC has its own crystal
+- DriftEstimator: sink rate from bytes consumed (written minus what the
+  stream reports still buffered) vs. wall clock, as a least-squares slope
+- Playback stops between replies, so each continuous run is its own
+  segment; segments are pooled (shared slope, own intercepts) with the
+  older ones decaying, and each segment's startup is skipped
+- adjust(): follows a sink's clock by duplicating or dropping single
+  samples at the quietest points of a chunk, far below audibility at the
+  few hundred ppm a USB DAC is off by
+"""
+
+from array import array
+
+SETTLE_SEC = 0.5          # skip a run's first samples: prebuffer, stream start
+MIN_SPAN_SEC = 5.0        # pooled playback needed before a ppm is trusted
+SEGMENT_DECAY = 0.8       # weight kept by older runs each time one closes
+MAX_PPM = 2000.0          # anything beyond this is a measurement glitch
+
+
+class DriftEstimator:
+    """Sink clock vs. wall clock from (time, bytes consumed) samples."""
+
+    def __init__(self, bytes_per_sec, settle_sec=SETTLE_SEC, min_span_sec=MIN_SPAN_SEC,
+                 decay=SEGMENT_DECAY):
+        self.bytes_per_sec = bytes_per_sec
+        self.settle_sec = settle_sec
+        self.min_span_sec = min_span_sec
+        self.decay = decay
+        self._sxx = self._sxy = self._span = 0.0   # closed runs, pooled
+        self._start = None
+        self._seg = None                           # [n, st, sc, stt, stc, first_t, last_t]
+
+    def restart(self):
+        """Playback drained: the next sample starts a new run."""
+        seg = self._seg
+        if seg and seg[0] >= 2:
+            sxx, sxy = self._moments(seg)
+            self._sxx = self._sxx * self.decay + sxx
+            self._sxy = self._sxy * self.decay + sxy
+            self._span = self._span * self.decay + seg[6] - seg[5]
+        self._start = None
+        self._seg = None
+
+    def add(self, t, consumed):
+        if self._start is None:
+            self._start = (t, consumed)
+        t0, c0 = self._start
+        x = t - t0
+        if x < self.settle_sec:
+            return
+        y = consumed - c0
+        seg = self._seg
+        if seg is None:
+            seg = self._seg = [0, 0.0, 0.0, 0.0, 0.0, x, x]
+        seg[0] += 1
+        seg[1] += x
+        seg[2] += y
+        seg[3] += x * x
+        seg[4] += x * y
+        seg[6] = x
+
+    @staticmethod
+    def _moments(seg):
+        n, st, sc, stt, stc = seg[:5]
+        return stt - st * st / n, stc - st * sc / n
+
+    @property
+    def ppm(self):
+        """How much faster (+) or slower (-) the sink plays than nominal, or None."""
+        sxx, sxy, span = self._sxx, self._sxy, self._span
+        seg = self._seg
+        if seg and seg[0] >= 2:
+            a, b = self._moments(seg)
+            sxx, sxy, span = sxx + a, sxy + b, span + seg[6] - seg[5]
+        if span < self.min_span_sec or sxx <= 0:
+            return None
+        ppm = (sxy / sxx / self.bytes_per_sec - 1.0) * 1e6
+        return ppm if abs(ppm) <= MAX_PPM else None
+
+
+def adjust(chunk, n):
+    """s16le mono chunk with n samples duplicated (n > 0) or dropped (n < 0)."""
+    a = array("h")
+    a.frombytes(chunk)
+    if not n or len(a) < 2 * abs(n):
+        return chunk
+    # One edit per equal slice, each at the slice's quietest sample; go
+    # back to front so earlier positions stay valid
+    step = len(a) // abs(n)
+    for k in reversed(range(abs(n))):
+        lo = k * step
+        i = min(range(lo, lo + step), key=lambda j: abs(a[j]))
+        if n > 0:
+            a.insert(i, a[i])
+        else:
+            del a[i]
+    return a.tobytes()
@@ -1,19 +1,22 @@
 #!/usr/bin/env python3
 """
 G1 Voice Chat - Pure PulseAudio (parec mic + pacat speakers)
-- Mic: parec from webcam PA source at 24kHz
-- Speakers: pacat to each USB speaker sink at 24kHz
+- Mic: parec from webcam PA source at 24kHz, or at its native rate with
+  an in-process polyphase resampler (MIC_CAPTURE_RATE)
+- Speakers: a stream to each USB speaker sink at 24kHz, in-process through
+  libpulse or one pacat each (AUDIO_BACKEND)
 - OpenAI Realtime API
+- The conversation itself runs on session.py, shared with g1_sparky_vision.py
 """
 
-import os, sys, asyncio, json, base64, time, subprocess
-import websockets
-import queue
-from concurrent.futures import ThreadPoolExecutor
+import os, sys, asyncio, time
 from dotenv import load_dotenv
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 import prompts
+from ringbuf import DROP_NEWEST
+import replay
+import session
 
 load_dotenv()
 
@@ -21,281 +24,149 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("OPENAI_REALTIME_MODEL", "gpt-4o-realtime-preview")
 VOICE = os.getenv("OPENAI_REALTIME_VOICE", "cedar")
+REALTIME_URL = os.getenv("OPENAI_REALTIME_URL", "wss://api.openai.com/v1/realtime")
 SYSTEM_PROMPT_NAME = os.getenv("COMPANY_PROFILE", "SPARKY")
 
+# Record a live session / replay one against `python replay.py serve DIR`
+RECORD_DIR = os.getenv("SPARKY_RECORD_DIR")
+REPLAY_DIR = os.getenv("SPARKY_REPLAY_DIR")
+REPLAY_SINKS = int(os.getenv("SPARKY_REPLAY_SINKS", "1"))
+
 PA_MIC_SOURCE = "alsa_input.usb-HCVsight_FHD_webcamera-02.mono-fallback"
 
 AUDIO_RATE = 24000
 S16LE_BYTES = 2
 MIC_CHUNK_BYTES = AUDIO_RATE * S16LE_BYTES // 10   # 100ms = 4800 bytes
+MIC_MAX_LATENCY_BYTES = AUDIO_RATE * S16LE_BYTES      # 1s; older mic audio is dropped
 SPEAKER_CHUNK_BYTES = AUDIO_RATE * S16LE_BYTES // 20  # 50ms = 2400 bytes
-PREBUFFER_BYTES = AUDIO_RATE * S16LE_BYTES // 4     # 250ms = 12000 bytes
-
-
-def find_usb_sinks():
-    """Find all USB audio PulseAudio sinks."""
-    try:
-        out = subprocess.check_output(["pactl", "list", "sinks", "short"], text=True)
-    except Exception:
-        return []
-    sinks = []
-    for line in out.strip().splitlines():
-        parts = line.split("\t")
-        if len(parts) >= 2 and "usb" in parts[1].lower():
-            sinks.append(parts[1])
-    return sinks
+PREBUFFER_BYTES = AUDIO_RATE * S16LE_BYTES // 4     # 250ms = 12000 bytes (initial)
+PREBUFFER_MIN_BYTES = AUDIO_RATE * S16LE_BYTES // 20  # 50ms floor (raised to lead + one chunk)
+PREBUFFER_MAX_BYTES = AUDIO_RATE * S16LE_BYTES      # 1s ceiling
+AUDIO_BUF_MAX_BYTES = AUDIO_RATE * S16LE_BYTES * 30  # 30s reply backlog cap
+AUDIO_BUF_OVERFLOW = DROP_NEWEST                    # keep what's about to play; drop the reply tail
+PLAYOUT_LEAD_SEC = 0.1                              # audio kept queued ahead in the sinks
+
+# --- Audio backend ("libpulse": in-process streams, falls back to pacat/parec
+# if libpulse-simple is missing; "subprocess": always pacat/parec) ---
+AUDIO_BACKEND = os.getenv("SPARKY_AUDIO_BACKEND", "libpulse")
+
+# --- Multi-speaker sync (drift is measured only with a latency-reporting
+# backend, i.e. libpulse) ---
+SINK_DRIFT_CORRECTION = True  # insert/drop single samples so each sink follows its own clock
+SINK_DELAYS_MS = {}           # sink name -> fixed delay, to line speakers up acoustically
+
+# --- Native mic capture (resampled here instead of by PulseAudio; needs NumPy) ---
+MIC_CAPTURE_RATE = None       # e.g. 48000: parec reads the device rate as is (None = PA resamples)
+MIC_CAPTURE_CHANNELS = 1      # channels the source delivers at that rate
+MIC_CHANNEL = None            # channel to keep; None = downmix all of them
+MIC_RESAMPLE_TAPS = 48        # filter taps per phase; adds ~taps/2 input samples of delay
+
+# --- Local VAD (gates silence before upload; needs NumPy) ---
+LOCAL_VAD = True
+VAD_PREFIX_PADDING_MS = 300   # pre-roll kept locally; same as server prefix_padding_ms
+VAD_SILENCE_MS = 700          # server silence_duration_ms; gate hangs on a bit longer
+
+# --- Full duplex (AEC keeps the mic open during replies; needs NumPy) ---
+FULL_DUPLEX = True
+BARGE_IN_CHUNKS = 2           # consecutive 100ms double-talk chunks that interrupt Sparky
+
+# --- Half duplex end of turn ---
+DRAIN_GUARD_SEC = 0.2         # after the speakers go quiet: room tail + parec latency
+FIXED_GAP_SEC = 1.5           # what we used to sleep; only for the saving log
+
+# --- Latency timeline (one JSON line per turn) ---
+LATENCY_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "turns.jsonl")
+
+# --- Conversation context retention (conversation.item.delete) ---
+CONTEXT_MAX_TOKENS = 16000    # estimated context size to stay under
+CONTEXT_KEEP_ITEMS = 4        # newest items are never evicted
+VISITOR_GONE_SEC = 120.0      # no speech for this long: start the next visitor fresh
+
+# --- Reconnect (devices stay up; only the websocket session is redone) ---
+RECONNECT_BASE_SEC = 0.25     # first retry within this; doubles per failed attempt
+RECONNECT_MAX_SEC = 10.0      # backoff ceiling (full jitter below it)
+
+# --- Phrase cache (short replies said word for word, kept on disk so a
+# greeting can start locally while the real reply is still being generated) ---
+PHRASE_CACHE_DIR = os.getenv("SPARKY_PHRASE_CACHE",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "phrase_cache"))
+PHRASE_CACHE_MAX_BYTES = 20 * 1024 * 1024
+PHRASE_MAX_SEC = 8.0          # longer replies are never cached
+GREETING_MIN_INTERVAL = 60.0  # at most one local greeting this often
+
+# --- Idle mode (nobody around: session closed, only a cheap local monitor runs) ---
+IDLE_AFTER_SEC = 300.0        # no speech for this long: go idle (0 = never)
+IDLE_WAKE_CHUNKS = 2          # consecutive voiced 100ms mic chunks that wake it up
+IDLE_HOLD_SEC = 1.5           # mic audio held while the session is down, replayed on connect
+IDLE_PREWARM_SEC = 5.0        # connection opened on a first voiced chunk is dropped if no wake follows
 
 
 async def main():
-    if not OPENAI_API_KEY:
+    if not OPENAI_API_KEY and not REPLAY_DIR:
         print("ERROR: OPENAI_API_KEY not set")
         return
+    cfg = sys.modules[__name__]
 
-    # Find USB speaker sinks
-    usb_sinks = find_usb_sinks()
-    if not usb_sinks:
-        print("ERROR: No USB speaker sinks found")
-        return
-    print(f"Speakers: {usb_sinks}")
-
-    # Start parec mic (PA resamples webcam 48kHz -> 24kHz)
-    mic_proc = subprocess.Popen(
-        ["parec", "--device", PA_MIC_SOURCE,
-         "--format=s16le", "--channels=1", "--rate=24000",
-         "--latency-msec=100"],
-        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    time.sleep(0.3)
-    if mic_proc.poll() is not None:
+    # Start the mic (PA resamples webcam 48kHz -> 24kHz unless MIC_CAPTURE_RATE is set)
+    mic_proc = await session.start_mic(cfg)
+    if not mic_proc:
         print("ERROR: parec failed to start")
         return
-    print(f"Mic: {PA_MIC_SOURCE} -> 24kHz")
-
-    # Start one pacat per USB speaker sink
-    speaker_procs = []
-    for sink in usb_sinks:
-        p = subprocess.Popen(
-            ["pacat", "--playback", "--device", sink,
-             "--format=s16le", "--channels=1", "--rate=24000",
-             "--latency-msec=50"],
-            stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        speaker_procs.append(p)
-        print(f"Speaker pipe: {sink}")
-
-    # Load prompt
-    prompt_text = prompts.get_prompt(SYSTEM_PROMPT_NAME)
-    print(f"Prompt: {SYSTEM_PROMPT_NAME}")
-
-    # Connect to OpenAI
-    url = f"wss://api.openai.com/v1/realtime?model={MODEL}"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "OpenAI-Beta": "realtime=v1",
-    }
-    print("Connecting...")
 
+    # One playback stream + writer thread per USB speaker sink (or
+    # file-backed stand-ins when replaying)
     try:
-        async with websockets.connect(url, additional_headers=headers,
-                                       ping_timeout=30, close_timeout=5) as ws:
-            print("Connected to OpenAI Realtime")
-
-            await ws.send(json.dumps({
-                "type": "session.update",
-                "session": {
-                    "modalities": ["audio", "text"],
-                    "instructions": "You must ONLY respond in English. Never speak Spanish or any other language.\n\n" + prompt_text,
-                    "voice": VOICE,
-                    "input_audio_format": "pcm16",
-                    "output_audio_format": "pcm16",
-                    "input_audio_transcription": {"model": "whisper-1", "language": "en"},
-                    "turn_detection": {
-                        "type": "server_vad",
-                        "threshold": 0.65,
-                        "prefix_padding_ms": 300,
-                        "silence_duration_ms": 700
-                    }
-                }
-            }))
-            print(f"Session configured - Voice: {VOICE}")
-            print("Speak to start. Ctrl+C to quit.\n")
-
-            # --- State ---
-            audio_buf = bytearray()
-            mic_on = True
-            prebuffered = False
-            is_running = True
-            response_active = False  # track if we're in a response cycle
-
-            # --- Mic reader thread ---
-            mic_q = queue.Queue(maxsize=200)
-
-            def read_mic():
-                while is_running:
-                    try:
-                        data = mic_proc.stdout.read(MIC_CHUNK_BYTES)
-                        if not data:
-                            break
-                        try:
-                            mic_q.put_nowait(data)
-                        except queue.Full:
-                            pass
-                    except Exception:
-                        break
-
-            ThreadPoolExecutor(max_workers=1).submit(read_mic)
-
-            # --- Write to all speakers ---
-            def write_speakers(data):
-                for i, p in enumerate(speaker_procs):
-                    try:
-                        if p.poll() is None:
-                            p.stdin.write(data)
-                            p.stdin.flush()
-                        else:
-                            speaker_procs[i] = subprocess.Popen(
-                                ["pacat", "--playback", "--device", usb_sinks[i],
-                                 "--format=s16le", "--channels=1", "--rate=24000",
-                                 "--latency-msec=50"],
-                                stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-                    except Exception:
-                        pass
-
-            # --- Speaker feeder ---
-            async def feeder():
-                nonlocal prebuffered
-                while is_running:
-                    if not prebuffered:
-                        if len(audio_buf) >= PREBUFFER_BYTES:
-                            prebuffered = True
-                            print("[Prebuffer OK - playing]")
-                        else:
-                            await asyncio.sleep(0.005)
-                            continue
-
-                    if len(audio_buf) >= SPEAKER_CHUNK_BYTES:
-                        chunk = bytes(audio_buf[:SPEAKER_CHUNK_BYTES])
-                        del audio_buf[:SPEAKER_CHUNK_BYTES]
-                        write_speakers(chunk)
-                        await asyncio.sleep(0.045)
-                    else:
-                        await asyncio.sleep(0.005)
-
-            # --- Mic sender ---
-            async def send_mic():
-                while is_running:
-                    if mic_on:
-                        try:
-                            data = mic_q.get_nowait()
-                            await ws.send(json.dumps({
-                                "type": "input_audio_buffer.append",
-                                "audio": base64.b64encode(data).decode(),
-                            }))
-                        except queue.Empty:
-                            pass
-                    else:
-                        try:
-                            mic_q.get_nowait()
-                        except queue.Empty:
-                            pass
-                    await asyncio.sleep(0.008)
-
-            # --- Receiver ---
-            async def recv():
-                nonlocal mic_on, prebuffered, response_active
-                while is_running:
-                    try:
-                        msg = json.loads(await ws.recv())
-                        t = msg.get("type")
-
-                        if t == "response.created":
-                            audio_buf.clear()
-                            prebuffered = False
-                            response_active = True
-                            if mic_on:
-                                mic_on = False
-                                print("[Mic muted]")
-
-                        elif t in ("response.audio.delta", "response.output_audio.delta"):
-                            if mic_on:
-                                mic_on = False
-                                print("[Mic muted]")
-                            b64 = msg.get("delta") or msg.get("audio") or ""
-                            if b64:
-                                audio_buf.extend(base64.b64decode(b64))
-
-                        elif t in ("response.audio.done", "response.output_audio.done", "response.done"):
-                            if not response_active:
-                                continue  # already handled, skip duplicate
-                            response_active = False
-                            t0 = time.time()
-                            while len(audio_buf) > 0 and time.time() - t0 < 10:
-                                await asyncio.sleep(0.02)
-                            # Delay to let speaker finish and avoid echo feedback
-                            await asyncio.sleep(1.5)
-                            # Drain any mic data captured during playback
-                            while not mic_q.empty():
-                                try:
-                                    mic_q.get_nowait()
-                                except queue.Empty:
-                                    break
-                            # Clear server-side input audio buffer
-                            await ws.send(json.dumps({
-                                "type": "input_audio_buffer.clear"
-                            }))
-                            prebuffered = False
-                            mic_on = True
-                            print("[Mic on]\n")
-
-                        elif t == "input_audio_buffer.speech_started":
-                            print("[Listening]")
-                            audio_buf.clear()
-                            prebuffered = False
-                            response_active = False
-                            if not mic_on:
-                                mic_on = True
-
-                        elif t == "response.audio_transcript.delta":
-                            print(msg.get("delta", ""), end="", flush=True)
-
-                        elif t == "response.audio_transcript.done":
-                            print()
-
-                        elif t == "input_audio_buffer.speech_stopped":
-                            print("[Processing...]")
+        spk = await session.start_speakers(cfg)
+    except Exception:
+        mic_proc.kill()
+        raise
+    if not spk:
+        print("ERROR: No USB speaker sinks found")
+        mic_proc.kill()
+        return
+    usb_sinks, tracker, speakers = spk
+    print(f"Speakers: {usb_sinks}")
+    engine = mic = recorder = None
 
-                        elif t == "conversation.item.input_audio_transcription.completed":
-                            print(f"You: {msg.get('transcript', '')}")
+    try:
+        # Devices are up: from here on everything is torn down in finally
+        prompt_text = prompts.get_prompt(SYSTEM_PROMPT_NAME)
+        print(f"Prompt: {SYSTEM_PROMPT_NAME}")
 
-                        elif t == "error":
-                            print(f"ERROR: {msg.get('error', {}).get('message', '?')}")
+        if RECORD_DIR:
+            recorder = replay.Recorder(RECORD_DIR)
+            print(f"Recording sessions to {RECORD_DIR}")
+        rt = session.Realtime(cfg, session.session_update(cfg, prompt_text), recorder)
 
-                    except websockets.exceptions.ConnectionClosed:
-                        print("Connection closed")
-                        break
-                    except Exception as e:
-                        print(f"Recv error: {e}")
-                        break
+        # --- Mic stream (parec pipe read on the event loop) ---
+        mic = session.mic_stream(cfg, mic_proc)
+        mic.start()
 
-            await asyncio.gather(
-                asyncio.create_task(feeder()),
-                asyncio.create_task(send_mic()),
-                asyncio.create_task(recv()),
-            )
+        engine = session.Session(cfg, rt, mic, speakers, tracker)
+        await engine.run()
 
     except KeyboardInterrupt:
         print("\nBye")
     except Exception as e:
         print(f"ERROR: {e}")
     finally:
-        is_running = False
+        if engine:
+            engine.close()
+        try:
+            if recorder:
+                recorder.close()
+        except Exception:
+            pass
+        try:
+            if mic:
+                mic.close()
+        except Exception:
+            pass
         try:
             mic_proc.kill()
         except Exception:
             pass
-        for p in speaker_procs:
-            try:
-                p.kill()
-            except Exception:
-                pass
+        speakers.stop()
         print("Done")
 
 
@@ -1,23 +1,28 @@
 #!/usr/bin/env python3
 """
 G1 Sparky Vision - PulseAudio voice + OpenCV webcam
-- Mic: parec from webcam PA source at 24kHz
-- Speakers: pacat to each USB speaker sink at 24kHz
-- Camera: OpenCV VideoCapture (USB webcam)
-- Periodically injects camera frames into conversation
+- Mic: parec from webcam PA source at 24kHz, or at its native rate with
+  an in-process polyphase resampler (MIC_CAPTURE_RATE)
+- Speakers: a stream to each USB speaker sink at 24kHz, in-process through
+  libpulse or one pacat each (AUDIO_BACKEND)
+- Camera: OpenCV VideoCapture (USB webcam), grabbed continuously but only
+  decoded on demand; native MJPEG frames are sent without re-encoding
+- Injects camera frames into conversation when the scene changes
 - OpenAI Realtime API
+- Startup: websocket handshake, speakers, mic and camera come up in parallel
+- The conversation itself runs on session.py, shared with g1_sparky.py
 """
 
-import os, sys, asyncio, json, base64, time, subprocess
-import websockets
-import queue
-import cv2
-import numpy as np
-from concurrent.futures import ThreadPoolExecutor
+import os, sys, asyncio, time
+T_PROCESS = time.monotonic()  # for the startup breakdown
 from dotenv import load_dotenv
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 import prompts
+from ringbuf import DROP_NEWEST
+import replay
+import session
+# camera, scene and imgenc (OpenCV/NumPy) load on the camera thread at startup
 
 load_dotenv()
 
@@ -25,364 +30,221 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MODEL = os.getenv("OPENAI_REALTIME_MODEL", "gpt-4o-realtime-preview")
 VOICE = os.getenv("OPENAI_REALTIME_VOICE", "cedar")
+REALTIME_URL = os.getenv("OPENAI_REALTIME_URL", "wss://api.openai.com/v1/realtime")
 SYSTEM_PROMPT_NAME = os.getenv("COMPANY_PROFILE", "SPARKY_VISION")
 
+# Record a live session / replay one against `python replay.py serve DIR`
+RECORD_DIR = os.getenv("SPARKY_RECORD_DIR")
+REPLAY_DIR = os.getenv("SPARKY_REPLAY_DIR")
+REPLAY_SINKS = int(os.getenv("SPARKY_REPLAY_SINKS", "1"))
+
 PA_MIC_SOURCE = "alsa_input.usb-HCVsight_FHD_webcamera-02.mono-fallback"
 
 AUDIO_RATE = 24000
 S16LE_BYTES = 2
 MIC_CHUNK_BYTES = AUDIO_RATE * S16LE_BYTES // 10     # 100ms = 4800 bytes
+MIC_MAX_LATENCY_BYTES = AUDIO_RATE * S16LE_BYTES      # 1s; older mic audio is dropped
 SPEAKER_CHUNK_BYTES = AUDIO_RATE * S16LE_BYTES // 20  # 50ms = 2400 bytes
-PREBUFFER_BYTES = AUDIO_RATE * S16LE_BYTES // 4       # 250ms = 12000 bytes
+PREBUFFER_BYTES = AUDIO_RATE * S16LE_BYTES // 4       # 250ms = 12000 bytes (initial)
+PREBUFFER_MIN_BYTES = AUDIO_RATE * S16LE_BYTES // 20  # 50ms floor (raised to lead + one chunk)
+PREBUFFER_MAX_BYTES = AUDIO_RATE * S16LE_BYTES        # 1s ceiling
+AUDIO_BUF_MAX_BYTES = AUDIO_RATE * S16LE_BYTES * 30   # 30s reply backlog cap
+AUDIO_BUF_OVERFLOW = DROP_NEWEST                      # keep what's about to play; drop the reply tail
+PLAYOUT_LEAD_SEC = 0.1                                # audio kept queued ahead in the sinks
+
+# --- Audio backend ("libpulse": in-process streams, falls back to pacat/parec
+# if libpulse-simple is missing; "subprocess": always pacat/parec) ---
+AUDIO_BACKEND = os.getenv("SPARKY_AUDIO_BACKEND", "libpulse")
+
+# --- Multi-speaker sync (drift is measured only with a latency-reporting
+# backend, i.e. libpulse) ---
+SINK_DRIFT_CORRECTION = True  # insert/drop single samples so each sink follows its own clock
+SINK_DELAYS_MS = {}           # sink name -> fixed delay, to line speakers up acoustically
+
+# --- Native mic capture (resampled here instead of by PulseAudio; needs NumPy) ---
+MIC_CAPTURE_RATE = None       # e.g. 48000: parec reads the device rate as is (None = PA resamples)
+MIC_CAPTURE_CHANNELS = 1      # channels the source delivers at that rate
+MIC_CHANNEL = None            # channel to keep; None = downmix all of them
+MIC_RESAMPLE_TAPS = 48        # filter taps per phase; adds ~taps/2 input samples of delay
+
+# --- Local VAD (gates silence before upload; needs NumPy) ---
+LOCAL_VAD = True
+VAD_PREFIX_PADDING_MS = 300   # pre-roll kept locally; same as server prefix_padding_ms
+VAD_SILENCE_MS = 700          # server silence_duration_ms; gate hangs on a bit longer
+
+# --- Full duplex (AEC keeps the mic open during replies; needs NumPy) ---
+FULL_DUPLEX = True
+BARGE_IN_CHUNKS = 2           # consecutive 100ms double-talk chunks that interrupt Sparky
+
+# --- Half duplex end of turn ---
+DRAIN_GUARD_SEC = 0.2         # after the speakers go quiet: room tail + parec latency
+FIXED_GAP_SEC = 1.5           # what we used to sleep; only for the saving log
+
+# --- Latency timeline (one JSON line per turn) ---
+LATENCY_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "turns.jsonl")
+
+# --- Conversation context retention (conversation.item.delete) ---
+CONTEXT_MAX_IMAGES = 3        # camera frames kept in the conversation
+CONTEXT_MAX_TOKENS = 16000    # estimated context size to stay under
+CONTEXT_KEEP_ITEMS = 4        # newest items are never evicted
+VISITOR_GONE_SEC = 120.0      # no speech for this long: start the next visitor fresh
+
+# --- Reconnect (devices stay up; only the websocket session is redone) ---
+RECONNECT_BASE_SEC = 0.25     # first retry within this; doubles per failed attempt
+RECONNECT_MAX_SEC = 10.0      # backoff ceiling (full jitter below it)
+
+# --- Phrase cache (short replies said word for word, kept on disk so a
+# greeting can start locally while the real reply is still being generated) ---
+PHRASE_CACHE_DIR = os.getenv("SPARKY_PHRASE_CACHE",
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), "phrase_cache"))
+PHRASE_CACHE_MAX_BYTES = 20 * 1024 * 1024
+PHRASE_MAX_SEC = 8.0          # longer replies are never cached
+GREETING_MIN_INTERVAL = 60.0  # at most one local greeting this often
+
+# --- Idle mode (nobody around: session closed, only a cheap local monitor runs) ---
+IDLE_AFTER_SEC = 300.0        # no speech or camera motion for this long: go idle (0 = never)
+IDLE_WAKE_CHUNKS = 2          # consecutive voiced 100ms mic chunks that wake it up
+IDLE_HOLD_SEC = 1.5           # mic audio held while the session is down, replayed on connect
+IDLE_PREWARM_SEC = 5.0        # connection opened on a first voiced chunk / small diff is dropped if no wake follows
+IDLE_PREWARM_DIFF = 0.5       # idle camera diff this share of the change threshold: pre-warm
 
 # --- Vision Config ---
 CAMERA_DEVICE = "/dev/video0"
-IMAGE_SEND_INTERVAL = 5.0     # Send a frame every N seconds
-JPEG_QUALITY = 75             # JPEG compression quality
+IMAGE_CHECK_INTERVAL = 0.25   # How often the latest frame is checked for a scene change
+IMAGE_MIN_INTERVAL = 2.0      # Never send frames closer together than this
+IMAGE_MAX_INTERVAL = 30.0     # Send a frame at least this often, changed or not
+SCENE_CHANGE_THRESHOLD = 10.0 # Mean abs diff (0-255 gray, 32x24) that counts as a new scene
+IDLE_CHECK_INTERVAL = 1.0     # Motion check rate while idle (no frames are encoded)
+JPEG_QUALITY = 75             # Starting JPEG quality; adapts to FRAME_MAX_BYTES
+FRAME_MAX_BYTES = 60000       # Per-frame JPEG budget
+FRAME_MAX_TOKENS = 425        # Per-frame image token budget (picks the resolution; 640x480 = 425)
+FRAME_CROP = True             # Crop to faces / motion before encoding
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
-
-
-def find_usb_sinks():
-    """Find all USB audio PulseAudio sinks."""
-    try:
-        out = subprocess.check_output(["pactl", "list", "sinks", "short"], text=True)
-    except Exception:
-        return []
-    sinks = []
-    for line in out.strip().splitlines():
-        parts = line.split("\t")
-        if len(parts) >= 2 and "usb" in parts[1].lower():
-            sinks.append(parts[1])
-    return sinks
-
-
-def encode_frame_to_data_url(frame: np.ndarray) -> str:
-    """Encode an OpenCV BGR frame to a JPEG data URL."""
-    ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-    if not ok:
-        return None
-    b64 = base64.b64encode(buf.tobytes()).decode("ascii")
-    return f"data:image/jpeg;base64,{b64}"
+CAMERA_MJPEG = True           # Use the camera's own JPEGs when it can deliver them
 
 
 async def main():
-    if not OPENAI_API_KEY:
+    if not OPENAI_API_KEY and not REPLAY_DIR:
         print("ERROR: OPENAI_API_KEY not set")
         return
 
-    # Find USB speaker sinks
-    usb_sinks = find_usb_sinks()
-    if not usb_sinks:
-        print("ERROR: No USB speaker sinks found")
-        return
-    print(f"Speakers: {usb_sinks}")
-
-    # Start parec mic
-    mic_proc = subprocess.Popen(
-        ["parec", "--device", PA_MIC_SOURCE,
-         "--format=s16le", "--channels=1", "--rate=24000",
-         "--latency-msec=100"],
-        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-    time.sleep(0.3)
-    if mic_proc.poll() is not None:
-        print("ERROR: parec failed to start")
-        return
-    print(f"Mic: {PA_MIC_SOURCE} -> 24kHz")
-
-    # Start one pacat per USB speaker sink
-    speaker_procs = []
-    for sink in usb_sinks:
-        p = subprocess.Popen(
-            ["pacat", "--playback", "--device", sink,
-             "--format=s16le", "--channels=1", "--rate=24000",
-             "--latency-msec=50"],
-            stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-        speaker_procs.append(p)
-        print(f"Speaker pipe: {sink}")
-
-    # Init webcam
-    print(f"Opening camera {CAMERA_DEVICE}...")
-    cap = cv2.VideoCapture(CAMERA_DEVICE, cv2.CAP_V4L2)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
-    if not cap.isOpened():
-        print("WARNING: Camera not available, running voice-only")
-        camera_ok = False
-    else:
-        # Warmup frames
-        for _ in range(10):
-            cap.read()
-        print(f"Camera ready: {int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}")
-        camera_ok = True
+    cfg = sys.modules[__name__]
 
     # Load prompt
     prompt_text = prompts.get_prompt(SYSTEM_PROMPT_NAME)
     print(f"Prompt: {SYSTEM_PROMPT_NAME}")
 
-    # Connect to OpenAI
-    url = f"wss://api.openai.com/v1/realtime?model={MODEL}"
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "OpenAI-Beta": "realtime=v1",
-    }
+    rt = session.Realtime(cfg, session.session_update(cfg, prompt_text))
+
+    # --- Startup: everything below overlaps; each step is timed ---
+    t_main = time.monotonic()
+    startup = {"imports": (t_main - T_PROCESS) * 1000.0}
+
+    async def timed(name, coro):
+        t0 = time.monotonic()
+        try:
+            return await coro
+        finally:
+            startup[name] = (time.monotonic() - t0) * 1000.0
+
     print("Connecting...")
+    first_conn = asyncio.create_task(timed("connect", rt.connect()))
+    results = await asyncio.gather(
+        timed("speakers", session.start_speakers(cfg)),
+        timed("mic", session.start_mic(cfg)),
+        timed("camera", asyncio.to_thread(session.open_camera, cfg)),
+        return_exceptions=True,
+    )
+    startup["devices"] = (time.monotonic() - t_main) * 1000.0
+    spk, mic_proc, cam = (None if isinstance(r, BaseException) else r for r in results)
+    error = next((r for r in results if isinstance(r, BaseException)), None)
+    if error or not spk or not mic_proc:
+        # Stop whatever did come up, so a retry doesn't start a second set
+        if error:
+            print(f"ERROR: device startup failed: {type(error).__name__}: {error}")
+        else:
+            print("ERROR: No USB speaker sinks found" if not spk else "ERROR: parec failed to start")
+        first_conn.cancel()
+        done = await asyncio.gather(first_conn, return_exceptions=True)
+        if isinstance(done[0], tuple):
+            await done[0][0].close()
+        if spk:
+            spk[2].stop()
+        if mic_proc:
+            mic_proc.kill()
+        if cam:
+            cam[0].stop()
+        if error:
+            raise error
+        return
+    usb_sinks, tracker, speakers = spk
+    print(f"Speakers: {usb_sinks}")
+    camera, scene, encoder = cam or (None, None, None)
+
+    def print_startup():
+        ready = (time.monotonic() - T_PROCESS) * 1000.0
+        print(f"[Startup] ready in {ready:.0f}ms: " + " ".join(
+            f"{k}={v:.0f}ms" for k, v in startup.items()))
+
+    engine = mic = recorder = None
 
     try:
-        async with websockets.connect(url, additional_headers=headers,
-                                       ping_timeout=30, close_timeout=5) as ws:
-            print("Connected to OpenAI Realtime")
-
-            await ws.send(json.dumps({
-                "type": "session.update",
-                "session": {
-                    "modalities": ["audio", "text"],
-                    "instructions": "You must ONLY respond in English. Never speak Spanish or any other language.\n\n" + prompt_text,
-                    "voice": VOICE,
-                    "input_audio_format": "pcm16",
-                    "output_audio_format": "pcm16",
-                    "input_audio_transcription": {"model": "whisper-1", "language": "en"},
-                    "turn_detection": {
-                        "type": "server_vad",
-                        "threshold": 0.65,
-                        "prefix_padding_ms": 300,
-                        "silence_duration_ms": 700
-                    }
-                }
-            }))
-            print(f"Session configured - Voice: {VOICE}")
-            print("Speak to start. Ctrl+C to quit.\n")
-
-            # --- State ---
-            audio_buf = bytearray()
-            mic_on = True
-            prebuffered = False
-            is_running = True
-            response_active = False
-            latest_frame = None
-            last_image_ts = 0.0
-
-            # --- Mic reader thread ---
-            mic_q = queue.Queue(maxsize=200)
-
-            def read_mic():
-                while is_running:
-                    try:
-                        data = mic_proc.stdout.read(MIC_CHUNK_BYTES)
-                        if not data:
-                            break
-                        try:
-                            mic_q.put_nowait(data)
-                        except queue.Full:
-                            pass
-                    except Exception:
-                        break
-
-            # --- Camera reader thread ---
-            def read_camera():
-                nonlocal latest_frame
-                if not camera_ok:
-                    return
-                while is_running:
-                    try:
-                        ret, frame = cap.read()
-                        if ret:
-                            latest_frame = frame
-                        time.sleep(0.033)  # ~30fps
-                    except Exception:
-                        time.sleep(0.1)
-
-            pool = ThreadPoolExecutor(max_workers=2)
-            pool.submit(read_mic)
-            pool.submit(read_camera)
-
-            # --- Write to all speakers ---
-            def write_speakers(data):
-                for i, p in enumerate(speaker_procs):
-                    try:
-                        if p.poll() is None:
-                            p.stdin.write(data)
-                            p.stdin.flush()
-                        else:
-                            speaker_procs[i] = subprocess.Popen(
-                                ["pacat", "--playback", "--device", usb_sinks[i],
-                                 "--format=s16le", "--channels=1", "--rate=24000",
-                                 "--latency-msec=50"],
-                                stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-                    except Exception:
-                        pass
-
-            # --- Speaker feeder ---
-            async def feeder():
-                nonlocal prebuffered
-                while is_running:
-                    if not prebuffered:
-                        if len(audio_buf) >= PREBUFFER_BYTES:
-                            prebuffered = True
-                            print("[Prebuffer OK - playing]")
-                        else:
-                            await asyncio.sleep(0.005)
-                            continue
-
-                    if len(audio_buf) >= SPEAKER_CHUNK_BYTES:
-                        chunk = bytes(audio_buf[:SPEAKER_CHUNK_BYTES])
-                        del audio_buf[:SPEAKER_CHUNK_BYTES]
-                        write_speakers(chunk)
-                        await asyncio.sleep(0.045)
-                    else:
-                        await asyncio.sleep(0.005)
-
-            # --- Mic sender ---
-            async def send_mic():
-                while is_running:
-                    if mic_on:
-                        try:
-                            data = mic_q.get_nowait()
-                            await ws.send(json.dumps({
-                                "type": "input_audio_buffer.append",
-                                "audio": base64.b64encode(data).decode(),
-                            }))
-                        except queue.Empty:
-                            pass
-                    else:
-                        try:
-                            mic_q.get_nowait()
-                        except queue.Empty:
-                            pass
-                    await asyncio.sleep(0.008)
-
-            # --- Image injector ---
-            async def image_injector():
-                nonlocal last_image_ts
-                if not camera_ok:
-                    return
-                while is_running:
-                    now = time.time()
-                    if (now - last_image_ts) >= IMAGE_SEND_INTERVAL and latest_frame is not None:
-                        data_url = encode_frame_to_data_url(latest_frame)
-                        if data_url:
-                            await ws.send(json.dumps({
-                                "type": "conversation.item.create",
-                                "item": {
-                                    "type": "message",
-                                    "role": "user",
-                                    "content": [
-                                        {
-                                            "type": "input_image",
-                                            "image_url": data_url
-                                        },
-                                        {
-                                            "type": "input_text",
-                                            "text": "(Latest camera frame - use this to see who you're talking to. Don't mention receiving an image unless asked what you see.)"
-                                        }
-                                    ]
-                                }
-                            }))
-                            print("[Camera frame sent]")
-                            last_image_ts = now
-                    await asyncio.sleep(0.5)
-
-            # --- Receiver ---
-            async def recv():
-                nonlocal mic_on, prebuffered, response_active
-                while is_running:
-                    try:
-                        msg = json.loads(await ws.recv())
-                        t = msg.get("type")
-
-                        if t == "response.created":
-                            audio_buf.clear()
-                            prebuffered = False
-                            response_active = True
-                            if mic_on:
-                                mic_on = False
-                                print("[Mic muted]")
-
-                        elif t in ("response.audio.delta", "response.output_audio.delta"):
-                            if mic_on:
-                                mic_on = False
-                                print("[Mic muted]")
-                            b64 = msg.get("delta") or msg.get("audio") or ""
-                            if b64:
-                                audio_buf.extend(base64.b64decode(b64))
-
-                        elif t in ("response.audio.done", "response.output_audio.done", "response.done"):
-                            if not response_active:
-                                continue
-                            response_active = False
-                            t0 = time.time()
-                            while len(audio_buf) > 0 and time.time() - t0 < 10:
-                                await asyncio.sleep(0.02)
-                            await asyncio.sleep(1.5)
-                            while not mic_q.empty():
-                                try:
-                                    mic_q.get_nowait()
-                                except queue.Empty:
-                                    break
-                            await ws.send(json.dumps({
-                                "type": "input_audio_buffer.clear"
-                            }))
-                            prebuffered = False
-                            mic_on = True
-                            print("[Mic on]\n")
-
-                        elif t == "input_audio_buffer.speech_started":
-                            print("[Listening]")
-                            audio_buf.clear()
-                            prebuffered = False
-                            response_active = False
-                            if not mic_on:
-                                mic_on = True
-
-                        elif t == "response.audio_transcript.delta":
-                            print(msg.get("delta", ""), end="", flush=True)
-
-                        elif t == "response.audio_transcript.done":
-                            print()
-
-                        elif t == "input_audio_buffer.speech_stopped":
-                            print("[Processing...]")
-
-                        elif t == "conversation.item.input_audio_transcription.completed":
-                            print(f"You: {msg.get('transcript', '')}")
-
-                        elif t == "error":
-                            print(f"ERROR: {msg.get('error', {}).get('message', '?')}")
-
-                    except websockets.exceptions.ConnectionClosed:
-                        print("Connection closed")
-                        break
-                    except Exception as e:
-                        print(f"Recv error: {e}")
-                        break
-
-            await asyncio.gather(
-                asyncio.create_task(feeder()),
-                asyncio.create_task(send_mic()),
-                asyncio.create_task(image_injector()),
-                asyncio.create_task(recv()),
-            )
+        # Devices are up: from here on everything is torn down in finally
+        if camera:
+            print(f"Camera ready: {camera.describe()}")
+        else:
+            print("WARNING: Camera not available, running voice-only")
+        if RECORD_DIR:
+            recorder = replay.Recorder(RECORD_DIR)
+            print(f"Recording sessions to {RECORD_DIR}")
+        rt.recorder = recorder
+
+        # --- Mic stream (parec pipe read on the event loop) ---
+        mic = session.mic_stream(cfg, mic_proc)
+        mic.start()
+
+        # --- Camera grab thread (frames decoded only on demand) ---
+        if camera:
+            camera.start()
+
+        engine = session.Session(cfg, rt, mic, speakers, tracker, camera, scene, encoder)
+        run = engine.run(first_conn, on_ready=print_startup)
+        first_conn = None
+        await run
 
     except KeyboardInterrupt:
         print("\nBye")
     except Exception as e:
         print(f"ERROR: {e}")
     finally:
-        is_running = False
+        if first_conn:
+            first_conn.cancel()
+            done = await asyncio.gather(first_conn, return_exceptions=True)
+            if isinstance(done[0], tuple):
+                await done[0][0].close()
+        if engine:
+            engine.close()
+        elif camera:
+            try:
+                camera.stop()
+            except Exception:
+                pass
+        try:
+            if recorder:
+                recorder.close()
+        except Exception:
+            pass
+        try:
+            if mic:
+                mic.close()
+        except Exception:
+            pass
         try:
             mic_proc.kill()
         except Exception:
             pass
-        for p in speaker_procs:
-            try:
-                p.kill()
-            except Exception:
-                pass
-        if camera_ok:
-            try:
-                cap.release()
-            except Exception:
-                pass
+        speakers.stop()
         print("Done")
 
 
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+G1 Stations - several Sparky booths from one process
+- A JSON manifest lists the stations: mic source and speaker sinks (both
+  required, never shared), camera (none for voice-only), prompt, voice
+  and any setting overrides
+- Each station is its own session.Session on one shared event loop;
+  frame encoding for every camera runs on one shared worker pool
+- Isolation: a station's devices and session live in their own task; an
+  error or a dead mic restarts that station alone, with backoff
+- Output lines are prefixed with the station name; a periodic summary
+  reports process CPU, event-loop lag and first-audio latency per
+  station and across all of them
+- Settings default to g1_sparky_vision.py's; per-station files
+  (turns-NAME.jsonl, phrase_cache/NAME) keep the stations apart
+
+  python g1_stations.py stations.json
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import time
+import types
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import g1_sparky_vision as base
+import prompts
+import replay
+import session
+from latency import percentile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATS_INTERVAL = 60.0       # seconds between summaries
+HEALTH_INTERVAL = 5.0       # how often a running station's mic is checked
+RESTART_BASE_SEC = 1.0      # first restart delay after a station goes down; doubles
+RESTART_MAX_SEC = 60.0      # restart backoff ceiling; a station up this long starts over
+LAG_INTERVAL = 0.1          # event-loop lag probe period
+
+STATION = contextvars.ContextVar("station", default=None)
+
+
+class StationOutput:
+    """stdout that prefixes each line with the station that printed it."""
+
+    def __init__(self, out):
+        self._out = out
+        self._partial = {}
+
+    def write(self, s):
+        name = STATION.get()
+        if name is None:
+            return self._out.write(s)
+        # Whole lines only, so streamed transcripts don't interleave
+        *lines, rest = (self._partial.pop(name, "") + s).split("\n")
+        if rest:
+            self._partial[name] = rest
+        for line in lines:
+            self._out.write(f"[{name}] {line}\n")
+        return len(s)
+
+    def flush(self):
+        self._out.flush()
+
+
+def station_config(entry):
+    """Settings for one manifest entry: the vision script's constants + overrides."""
+    name = entry["name"]
+    # Falling back to the shared source / every USB sink would let two
+    # stations grab the same devices
+    for key in ("mic", "sinks"):
+        if not entry.get(key):
+            raise ValueError(f"station {name}: no {key} given")
+    cfg = types.SimpleNamespace(**{k: v for k, v in vars(base).items() if k.isupper()})
+    camera = entry.get("camera")
+    cfg.PA_MIC_SOURCE = entry["mic"]
+    cfg.CAMERA_DEVICE = camera
+    cfg.SYSTEM_PROMPT_NAME = entry.get("prompt", "SPARKY_VISION" if camera else "SPARKY")
+    cfg.VOICE = entry.get("voice", cfg.VOICE)
+    cfg.LATENCY_LOG = os.path.join(HERE, f"turns-{name}.jsonl")
+    if cfg.PHRASE_CACHE_DIR:
+        cfg.PHRASE_CACHE_DIR = os.path.join(cfg.PHRASE_CACHE_DIR, name)
+    if cfg.RECORD_DIR:
+        cfg.RECORD_DIR = os.path.join(cfg.RECORD_DIR, name)
+    for key, value in (entry.get("config") or {}).items():
+        if not hasattr(cfg, key):
+            raise ValueError(f"station {name}: unknown setting {key}")
+        setattr(cfg, key, value)
+    return cfg
+
+
+class LoopLag:
+    """How late the shared event loop wakes up; a blocking station shows here."""
+
+    def __init__(self, window=600):
+        self._ms = deque(maxlen=window)
+        self.max_ms = 0.0
+
+    async def run(self):
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL)
+            ms = (time.monotonic() - t0 - LAG_INTERVAL) * 1000.0
+            self._ms.append(ms)
+            self.max_ms = max(self.max_ms, ms)
+
+    def p95(self):
+        return percentile(sorted(self._ms), 95) or 0.0
+
+
+class Station:
+    """One booth: brings up its devices, runs its session, restarts it when it fails."""
+
+    def __init__(self, name, cfg, sinks=None, pool=None):
+        self.name = name
+        self.cfg = cfg
+        self.sinks = sinks
+        self.pool = pool
+        self.engine = None
+        self.status = "starting"
+        self.restarts = 0
+        self._first_audio = deque(maxlen=500)   # from sessions before a restart
+        self._turns = 0
+        self._reconnects = 0
+
+    async def run(self):
+        STATION.set(self.name)
+        delay = RESTART_BASE_SEC
+        while True:
+            t0 = time.monotonic()
+            try:
+                await self._run_once()
+                reason = "session ended"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                reason = f"{type(e).__name__}: {e}"
+            if time.monotonic() - t0 > RESTART_MAX_SEC:
+                delay = RESTART_BASE_SEC
+            self.status = "down"
+            self.restarts += 1
+            print(f"[Station down: {reason}] restart {self.restarts} in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(RESTART_MAX_SEC, delay * 2)
+
+    async def _run_once(self):
+        cfg = self.cfg
+        self.status = "starting"
+        prompt_text = prompts.get_prompt(cfg.SYSTEM_PROMPT_NAME)
+        print(f"Prompt: {cfg.SYSTEM_PROMPT_NAME}")
+        recorder = replay.Recorder(cfg.RECORD_DIR) if cfg.RECORD_DIR else None
+        rt = session.Realtime(cfg, session.session_update(cfg, prompt_text), recorder)
+
+        print("Connecting...")
+        first_conn = asyncio.create_task(rt.connect())
+        spk = mic_proc = cam = mic = engine = None
+        try:
+            # Same overlapped bring-up as g1_sparky_vision.py
+            results = await asyncio.gather(
+                session.start_speakers(cfg, self.sinks),
+                session.start_mic(cfg),
+                asyncio.to_thread(session.open_camera, cfg) if cfg.CAMERA_DEVICE else asyncio.sleep(0),
+                return_exceptions=True)
+            spk, mic_proc, cam = (None if isinstance(r, BaseException) else r for r in results)
+            for r in results:
+                if isinstance(r, BaseException):
+                    raise r
+            if not spk:
+                raise RuntimeError("no speaker sinks")
+            if not mic_proc:
+                raise RuntimeError("parec failed to start")
+            usb_sinks, tracker, speakers = spk
+            print(f"Speakers: {usb_sinks}")
+            if cam:
+                print(f"Camera ready: {cam[0].describe()}")
+                cam[0].start()
+            elif cfg.CAMERA_DEVICE:
+                print("WARNING: Camera not available, running voice-only")
+
+            mic = session.mic_stream(cfg, mic_proc)
+            mic.start()
+            engine = self.engine = session.Session(
+                cfg, rt, mic, speakers, tracker, *(cam or ()), pool=self.pool)
+            run = asyncio.create_task(engine.run(first_conn))
+            first_conn = None
+            self.status = "up"
+            try:
+                while not run.done():
+                    await asyncio.wait([run], timeout=HEALTH_INTERVAL)
+                    if mic.closed or mic_proc.poll() is not None:
+                        raise RuntimeError("mic stream ended")
+                run.result()
+            finally:
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+        finally:
+            if first_conn:
+                first_conn.cancel()
+                done = await asyncio.gather(first_conn, return_exceptions=True)
+                if isinstance(done[0], tuple):
+                    await done[0][0].close()
+            if engine:
+                self._keep(engine)
+                engine.close()
+                self.engine = None
+            elif cam:
+                cam[0].stop()
+            if mic:
+                mic.close()
+            if mic_proc:
+                mic_proc.kill()
+            if spk:
+                spk[2].stop()
+            if recorder:
+                recorder.close()
+
+    def _keep(self, engine):
+        # Carry stats over a restart
+        self._first_audio.extend(engine.timeline.samples("first_write"))
+        self._turns += engine.timeline.turns
+        self._reconnects += engine.reconnects
+
+    def stats(self):
+        first_audio = list(self._first_audio)
+        turns, reconnects = self._turns, self._reconnects
+        if self.engine:
+            first_audio += self.engine.timeline.samples("first_write")
+            turns += self.engine.timeline.turns
+            reconnects += self.engine.reconnects
+        return {
+            "status": "idle" if self.engine and self.engine.state.idle else self.status,
+            "turns": turns,
+            "first_audio": first_audio,
+            "reconnects": reconnects,
+            "restarts": self.restarts,
+        }
+
+
+def latency_text(samples):
+    vals = sorted(samples)
+    if not vals:
+        return "first_audio -"
+    return (f"first_audio p50/p95={percentile(vals, 50):.0f}/{percentile(vals, 95):.0f}ms "
+            f"(n={len(vals)})")
+
+
+def print_stats(stations, lag, cpu0, wall0):
+    cpu = time.process_time() - cpu0
+    wall = max(1e-6, time.monotonic() - wall0)
+    print(f"[Stations] cpu={cpu / wall:.0%} of one core, "
+          f"loop lag p95={lag.p95():.0f}ms max={lag.max_ms:.0f}ms")
+    everything, turns = [], 0
+    for st in stations:
+        s = st.stats()
+        everything += s["first_audio"]
+        turns += s["turns"]
+        print(f"[Stations] {st.name}: {s['status']} turns={s['turns']} {latency_text(s['first_audio'])} "
+              f"reconnects={s['reconnects']} restarts={s['restarts']}")
+    print(f"[Stations] all: turns={turns} {latency_text(everything)}")
+
+
+async def report(stations, lag, cpu0, wall0):
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        print_stats(stations, lag, cpu0, wall0)
+
+
+async def main(manifest_path):
+    if not base.OPENAI_API_KEY and not base.REPLAY_DIR:
+        print("ERROR: OPENAI_API_KEY not set")
+        return
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    entries = manifest["stations"] if isinstance(manifest, dict) else manifest
+    names = [e["name"] for e in entries]
+    if len(set(names)) != len(names):
+        print("ERROR: station names must be unique")
+        return
+
+    try:
+        configs = [station_config(e) for e in entries]
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return
+    devices = [e["mic"] for e in entries] + [s for e in entries for s in e["sinks"]]
+    if len(set(devices)) != len(devices):
+        print("ERROR: stations must not share a mic or sink")
+        return
+
+    # One frame in flight per camera station, so a hung camera only ever
+    # holds its own worker
+    cameras = sum(1 for e in entries if e.get("camera"))
+    pool = ThreadPoolExecutor(max_workers=max(1, cameras), thread_name_prefix="frame")
+    stations = [Station(e["name"], cfg, e["sinks"], pool) for e, cfg in zip(entries, configs)]
+    print(f"Stations: {', '.join(names)}")
+
+    sys.stdout = StationOutput(sys.stdout)
+    lag = LoopLag()
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    try:
+        await asyncio.gather(
+            lag.run(),
+            report(stations, lag, cpu0, wall0),
+            *(st.run() for st in stations),
+        )
+    finally:
+        print_stats(stations, lag, cpu0, wall0)
+        pool.shutdown(wait=False, cancel_futures=True)
+        print("Done")
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Run several Sparky stations from one process")
+    p.add_argument("manifest", help="JSON station manifest (see stations.example.json)")
+    args = p.parse_args()
+    try:
+        asyncio.run(main(args.manifest))
+    except KeyboardInterrupt:
+        pass
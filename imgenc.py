@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Adaptive camera frame encoder
+- Resolution: the largest width step whose estimated image tokens fit the
+  per-frame token budget (never upscales)
+- JPEG quality: starts from the last frame's choice, steps down until the
+  frame fits the byte budget, steps back up when there is headroom
+- Optional crop to faces (Haar cascade) or, failing that, to what moved
+  since the last frame sent; padded, kept at the frame's aspect ratio
+- The camera's own JPEG goes through untouched when nothing needs changing
+- encode() returns a decision dict with every frame for logging/tuning
+"""
+
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+def image_tokens(w, h):
+    """Estimated input tokens for a high-detail image of w x h."""
+    s = min(1.0, 2048.0 / max(w, h))
+    w, h = w * s, h * s
+    s = min(1.0, 768.0 / min(w, h))
+    w, h = w * s, h * s
+    return 85 + 170 * math.ceil(w / 512.0) * math.ceil(h / 512.0)
+
+
+def _face_cascade():
+    # Both are gone from some OpenCV builds (5.x): crop on motion only then
+    data = getattr(cv2, "data", None)
+    if data is None or getattr(cv2, "CascadeClassifier", None) is None:
+        return None
+    path = os.path.join(data.haarcascades, "haarcascade_frontalface_default.xml")
+    cascade = cv2.CascadeClassifier(path)
+    return None if cascade.empty() else cascade
+
+
+class AdaptiveEncoder:
+    """Fits each frame into a byte and token budget."""
+
+    def __init__(self, max_bytes=60000, max_tokens=425, widths=(640, 512, 384, 320),
+                 qualities=(85, 75, 65, 55, 45, 35), start_quality=75, crop=True,
+                 crop_min=0.4, motion_threshold=25):
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.widths = sorted(widths, reverse=True)
+        self.qualities = sorted(qualities, reverse=True)
+        self._qi = min(range(len(self.qualities)),
+                       key=lambda i: abs(self.qualities[i] - start_quality))
+        self.crop = crop
+        self.crop_min = crop_min
+        self.motion_threshold = motion_threshold
+        self._faces = _face_cascade() if crop else None
+        self._prev = None
+
+        self.frames = 0
+        self.passthrough = 0
+        self.crops = 0
+        self.over_budget = 0
+
+    # --- Region of interest ---
+
+    def _roi(self, snap, w, h):
+        """(x, y, w, h) to crop to and why, or (None, why)."""
+        small = snap.gray(8)
+        prev, self._prev = self._prev, cv2.GaussianBlur(small, (5, 5), 0)
+
+        box, why = None, "none"
+        if self._faces is not None:
+            gray = snap.gray(2)
+            scale = w / gray.shape[1]
+            faces = self._faces.detectMultiScale(gray, 1.2, 5, minSize=(24, 24))
+            if len(faces):
+                x0 = min(f[0] for f in faces)
+                y0 = min(f[1] for f in faces)
+                x1 = max(f[0] + f[2] for f in faces)
+                y1 = max(f[1] + f[3] for f in faces)
+                fw = max(f[2] for f in faces)
+                # Head and shoulders around every face
+                box = ((x0 - fw) * scale, (y0 - fw * 0.5) * scale,
+                       (x1 + fw) * scale, (y1 + fw * 2.0) * scale)
+                why = "face"
+        if box is None and prev is not None and prev.shape == self._prev.shape:
+            moved = cv2.absdiff(self._prev, prev) > self.motion_threshold
+            if np.count_nonzero(moved) > moved.size * 0.005:
+                ys, xs = np.nonzero(moved)
+                scale = w / moved.shape[1]
+                pad = 0.15 * moved.shape[1]
+                box = ((xs.min() - pad) * scale, (ys.min() - pad) * scale,
+                       (xs.max() + 1 + pad) * scale, (ys.max() + 1 + pad) * scale)
+                why = "motion"
+        if box is None:
+            return None, why
+        return self._fit_box(box, w, h), why
+
+    def _fit_box(self, box, w, h):
+        x0, y0, x1, y1 = box
+        cx, cy = (x0 + x1) / 2.0, (y0 + y1) / 2.0
+        bw = max(x1 - x0, w * self.crop_min)
+        bh = max(y1 - y0, h * self.crop_min)
+        # Same aspect as the frame so the resolution steps still apply
+        if bw / bh > w / h:
+            bh = bw * h / w
+        else:
+            bw = bh * w / h
+        bw, bh = min(bw, w), min(bh, h)
+        x = int(min(max(cx - bw / 2.0, 0), w - bw))
+        y = int(min(max(cy - bh / 2.0, 0), h - bh))
+        return x, y, int(bw), int(bh)
+
+    # --- Encoding ---
+
+    def _pick_width(self, w, h):
+        for tw in self.widths:
+            if tw <= w and image_tokens(tw, h * tw / w) <= self.max_tokens:
+                return tw
+        return min(w, self.widths[-1])
+
+    def encode(self, snap):
+        """Returns (jpeg bytes or None, decision dict)."""
+        t0 = time.perf_counter()
+        self.frames += 1
+        if snap.jpeg is not None and not snap.decoded:
+            # Size from the 1/8 decode; avoids a full decode for passthrough
+            g = snap.gray(8)
+            w, h = g.shape[1] * 8, g.shape[0] * 8
+        else:
+            h, w = snap.image.shape[:2]
+        roi, why = self._roi(snap, w, h) if self.crop else (None, "off")
+        dec = {"src": f"{w}x{h}", "crop": why, "roi": list(roi) if roi else None}
+
+        if (snap.jpeg is not None and roi is None and len(snap.jpeg) <= self.max_bytes
+                and image_tokens(w, h) <= self.max_tokens):
+            self.passthrough += 1
+            dec.update(size=f"{w}x{h}", quality=None, bytes=len(snap.jpeg),
+                       tokens=image_tokens(w, h), tries=0,
+                       ms=round((time.perf_counter() - t0) * 1000.0, 1))
+            return snap.jpeg, dec
+
+        img = snap.image
+        if img is None:
+            return None, dec
+        if roi:
+            self.crops += 1
+            x, y, cw, ch = roi
+            img = img[y:y + ch, x:x + cw]
+        ih, iw = img.shape[:2]
+        tw = self._pick_width(iw, ih)
+        if tw < iw:
+            img = cv2.resize(img, (tw, round(ih * tw / iw)), interpolation=cv2.INTER_AREA)
+        ih, iw = img.shape[:2]
+
+        i, tries, jpeg = self._qi, 0, None
+        while True:
+            tries += 1
+            ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.qualities[i]])
+            if not ok:
+                return None, dec
+            jpeg = buf.tobytes()
+            if len(jpeg) <= self.max_bytes or i == len(self.qualities) - 1:
+                break
+            i += 1
+        if len(jpeg) > self.max_bytes:
+            self.over_budget += 1
+        # Next frame starts here, one step better if this one had headroom
+        self._qi = i - 1 if i > 0 and len(jpeg) < self.max_bytes * 0.6 else i
+
+        dec.update(size=f"{iw}x{ih}", quality=self.qualities[i], bytes=len(jpeg),
+                   tokens=image_tokens(iw, ih), tries=tries,
+                   ms=round((time.perf_counter() - t0) * 1000.0, 1))
+        return jpeg, dec
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "passthrough": self.passthrough,
+            "crops": self.crops,
+            "over_budget": self.over_budget,
+            "quality": self.qualities[self._qi],
+        }
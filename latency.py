@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Per-turn latency timeline
+- mark() stamps a milestone with time.monotonic(); first stamp wins
+- end_turn() turns the stamps into ms offsets from speech_stopped, feeds
+  rolling p50/p95/p99 windows and appends one JSON line per turn
+- A dict store per mark and one small write per turn: cheap enough to leave on
+"""
+
+import json
+import time
+from collections import deque
+
+MILESTONES = (
+    "speech_stopped",
+    "response_created",
+    "first_delta",
+    "prebuffered",
+    "first_write",
+    "last_write",
+    "mic_reopen",
+)
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    k = min(len(sorted_vals) - 1, max(0, round(p / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+class TurnTimeline:
+    """Collects one turn's milestones and keeps rolling histograms."""
+
+    def __init__(self, path=None, window=500):
+        self.path = path
+        self._fh = None
+        self._marks = {}
+        self._hist = {m: deque(maxlen=window) for m in MILESTONES[1:]}
+        self.turns = 0
+
+    def mark(self, name, now=None):
+        if name not in self._marks:
+            self._marks[name] = time.monotonic() if now is None else now
+
+    def mark_last(self, name, now=None):
+        """Stamp that keeps moving (e.g. last speaker write)."""
+        self._marks[name] = time.monotonic() if now is None else now
+
+    def begin_turn(self, now=None):
+        """speech_stopped: close any turn in flight and start a new one."""
+        if "response_created" in self._marks:
+            self.end_turn(interrupted=True)
+        self._marks = {}
+        self.mark("speech_stopped", now)
+
+    @property
+    def active(self):
+        return "speech_stopped" in self._marks
+
+    def end_turn(self, interrupted=False, **extra):
+        """Record the turn; returns its record (or None if nothing started)."""
+        marks, self._marks = self._marks, {}
+        t0 = marks.get("speech_stopped")
+        if t0 is None:
+            return None
+        self.turns += 1
+        offsets = {}
+        for name in MILESTONES[1:]:
+            if name in marks:
+                ms = round((marks[name] - t0) * 1000.0, 1)
+                offsets[name] = ms
+                if not interrupted or name != "last_write":
+                    self._hist[name].append(ms)
+        rec = {"ts": round(time.time(), 3), "turn": self.turns,
+               "interrupted": interrupted, "ms": offsets}
+        rec.update(extra)
+        if self.path:
+            try:
+                if self._fh is None:
+                    self._fh = open(self.path, "a", buffering=1)
+                self._fh.write(json.dumps(rec) + "\n")
+            except OSError:
+                self.path = None
+        return rec
+
+    def samples(self, name):
+        """The rolling window for a milestone, e.g. to merge several timelines."""
+        return list(self._hist[name])
+
+    def summary(self, name):
+        vals = sorted(self._hist[name])
+        return {
+            "n": len(vals),
+            "p50": percentile(vals, 50),
+            "p95": percentile(vals, 95),
+            "p99": percentile(vals, 99),
+        }
+
+    def close(self):
+        if self._fh:
+            self._fh.close()
+            self._fh = None
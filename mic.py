@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Event-driven mic stream - parec stdout read straight on the event loop
+- loop.add_reader() on the non-blocking pipe, no thread and no polling
+- Buffered in a PcmRing capped at a max latency; overflow drops the oldest audio
+- Optional resampler converts native-rate captures as they are read, so
+  the ring (and VAD/AEC behind it) only ever sees 24kHz s16le mono
+- Counts chunks delivered, bytes dropped to the cap and bytes flushed
+"""
+
+import asyncio
+import os
+
+from ringbuf import PcmRing, DROP_OLDEST
+
+
+class MicStream:
+    """Fixed-size PCM chunks from a pipe, delivered as they arrive."""
+
+    def __init__(self, pipe, chunk_bytes, max_latency_bytes, read_bytes=65536, resampler=None):
+        self.chunk_bytes = chunk_bytes
+        self.resampler = resampler
+        self._fd = pipe.fileno()
+        self._ring = PcmRing(max(max_latency_bytes, chunk_bytes), overflow=DROP_OLDEST)
+        self._scratch = bytearray(read_bytes)
+        self._ready = asyncio.Event()
+        self._loop = None
+        self.closed = False
+
+        self.chunks = 0
+        self.flushed_bytes = 0
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_running_loop()
+        os.set_blocking(self._fd, False)
+        self._loop.add_reader(self._fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            n = os.readv(self._fd, [self._scratch])
+        except BlockingIOError:
+            return
+        except OSError:
+            n = 0
+        if not n:
+            self.close()
+            return
+        data = memoryview(self._scratch)[:n]
+        if self.resampler:
+            data = self.resampler.process(data)
+        self._ring.write(data)
+        if len(self._ring) >= self.chunk_bytes:
+            self._ready.set()
+
+    async def read(self):
+        """Next chunk as a memoryview (valid until the next await), or None at EOF."""
+        while len(self._ring) < self.chunk_bytes:
+            if self.closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        self.chunks += 1
+        return self._ring.read(self.chunk_bytes)
+
+    def clear(self):
+        """Discard everything buffered (e.g. audio captured during playback)."""
+        self.flushed_bytes += len(self._ring)
+        self._ring.clear()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._loop is not None:
+            try:
+                self._loop.remove_reader(self._fd)
+            except Exception:
+                pass
+        self._ready.set()
+
+    @property
+    def dropped_bytes(self):
+        return self._ring.dropped_bytes
+
+    def stats(self):
+        st = {
+            "chunks": self.chunks,
+            "depth": len(self._ring),
+            "dropped_bytes": self._ring.dropped_bytes,
+            "overflows": self._ring.overflows,
+            "flushed_bytes": self.flushed_bytes,
+        }
+        if self.resampler:
+            st.update(self.resampler.stats())
+        return st
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+On-disk PCM cache of phrases Sparky says word for word
+- Keyed by normalized text + voice + model; one .pcm file per phrase plus
+  index.json (text, size, last use, and how often short replies recur)
+- Filled from completed replies: canned lines are kept the first time they
+  are heard, other short replies once they have come back min_count times
+- Size-bounded; the least recently played phrases are evicted first
+- pick() rotates through cached candidates (least recently played first)
+- Thread-safe: callers run lookups and offers on a worker thread so the
+  file I/O stays off the event loop
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+def normalize(text):
+    return re.sub(r"[^a-z0-9']+", " ", text.lower()).strip()
+
+
+class PhraseCache:
+    """Stores s16le reply audio for exact phrases."""
+
+    def __init__(self, path, max_bytes=20 * 1024 * 1024, canned=(), max_chars=80,
+                 min_count=2, max_counts=500):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.canned = {normalize(t) for t in canned}
+        self.max_chars = max_chars
+        self.min_count = min_count
+        self.max_counts = max_counts
+        self._index = {}       # key -> {"text", "voice", "model", "bytes", "used"}
+        self._counts = {}      # normalized text -> times heard
+        self.hits = 0
+        self.stored = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, "index.json")) as f:
+                data = json.load(f)
+            self._index = data.get("phrases", {})
+            self._counts = data.get("counts", {})
+        except (OSError, ValueError):
+            pass
+        # Drop entries whose audio went missing
+        for key in [k for k in self._index if not os.path.exists(self._file(k))]:
+            del self._index[key]
+
+    def _key(self, text, voice, model):
+        raw = f"{normalize(text)}|{voice}|{model}".encode()
+        return hashlib.sha1(raw).hexdigest()[:20]
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".pcm")
+
+    def _save(self):
+        tmp = os.path.join(self.path, "index.json.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"phrases": self._index, "counts": self._counts}, f)
+            os.replace(tmp, os.path.join(self.path, "index.json"))
+        except OSError:
+            pass
+
+    @property
+    def size(self):
+        return sum(e["bytes"] for e in self._index.values())
+
+    # --- Lookup ---
+
+    def get(self, text, voice, model):
+        with self._lock:
+            return self._get(text, voice, model)
+
+    def _get(self, text, voice, model):
+        key = self._key(text, voice, model)
+        if key not in self._index:
+            return None
+        try:
+            with open(self._file(key), "rb") as f:
+                pcm = f.read()
+        except OSError:
+            del self._index[key]
+            return None
+        self._index[key]["used"] = time.time()
+        self.hits += 1
+        self._save()
+        return pcm
+
+    def pick(self, texts, voice, model):
+        """(text, pcm) for the least recently played cached candidate, or None."""
+        with self._lock:
+            cached = [(self._index[k]["used"], t) for t in texts
+                      if (k := self._key(t, voice, model)) in self._index]
+            if not cached:
+                return None
+            text = min(cached)[1]
+            pcm = self._get(text, voice, model)
+        return (text, pcm) if pcm else None
+
+    # --- Filling ---
+
+    def offer(self, text, voice, model, pcm):
+        """A reply finished playing in full; keep its audio if it is worth it."""
+        with self._lock:
+            return self._offer(text, voice, model, pcm)
+
+    def _offer(self, text, voice, model, pcm):
+        norm = normalize(text)
+        if not norm or len(norm) > self.max_chars or not pcm:
+            return False
+        key = self._key(text, voice, model)
+        if key in self._index:
+            return False
+        if norm not in self.canned:
+            self._counts[norm] = self._counts.get(norm, 0) + 1
+            if len(self._counts) > self.max_counts:
+                for t, _ in sorted(self._counts.items(), key=lambda kv: kv[1])[:len(self._counts) - self.max_counts]:
+                    del self._counts[t]
+            if self._counts.get(norm, 0) < self.min_count:
+                self._save()
+                return False
+        try:
+            with open(self._file(key), "wb") as f:
+                f.write(pcm)
+        except OSError:
+            return False
+        self._index[key] = {"text": text, "voice": voice, "model": model,
+                            "bytes": len(pcm), "used": time.time()}
+        self.stored += 1
+        self._evict()
+        self._save()
+        return True
+
+    def _evict(self):
+        total = self.size
+        for key, entry in sorted(self._index.items(), key=lambda kv: kv[1]["used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+            total -= entry["bytes"]
+            del self._index[key]
+            self.evicted += 1
+
+    def stats(self):
+        # Called on the event loop: a snapshot, no waiting on a worker's I/O
+        entries = list(self._index.values())
+        return {
+            "phrases": len(entries),
+            "kb": sum(e["bytes"] for e in entries) // 1024,
+            "hits": self.hits,
+            "stored": self.stored,
+            "evicted": self.evicted,
+        }
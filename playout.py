@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Speaker playout scheduling
+- Paces writes to the sinks off a monotonic clock instead of fixed sleeps
+- Keeps a target lead of audio queued in the sinks
+- Sizes the prebuffer from the measured arrival jitter of audio deltas
+- Counts underruns (sinks ran dry) and overruns (backlog over its cap)
+- Tracks how much of each assistant item actually reached the sinks
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class PlayoutScheduler:
+    """Clock-driven pacing for one stream of PCM chunks."""
+
+    def __init__(self, bytes_per_sec, prebuffer_bytes, min_prebuffer_bytes,
+                 max_prebuffer_bytes, lead_sec=0.1, margin_sec=0.04, history=8, chunk_bytes=0):
+        self.bytes_per_sec = bytes_per_sec
+        # Up to the lead goes to the sinks at once; a smaller prebuffer
+        # leaves nothing in hand for the next chunk
+        floor = int(lead_sec * bytes_per_sec) + chunk_bytes
+        self.min_prebuffer_bytes = max(min_prebuffer_bytes, floor - floor % 2)
+        self.max_prebuffer_bytes = max(max_prebuffer_bytes, self.min_prebuffer_bytes)
+        self.prebuffer_bytes = max(prebuffer_bytes, self.min_prebuffer_bytes)
+        self.lead_sec = lead_sec
+        self.slack_sec = 0.01
+        self.margin_sec = margin_sec
+
+        self.underruns = 0
+        self.overruns = 0
+        self.overrun_bytes = 0
+
+        # Arrival side: lateness of each delta vs. a real-time schedule
+        # anchored at the first delta of the response.
+        self._arrival_t0 = None
+        self._arrived = 0
+        self._peak_late = 0.0
+        self._late_history = deque(maxlen=history)
+
+        # Playout side: audio written since start() vs. wall clock.
+        self._play_t0 = None
+        self._written = 0
+
+    # --- Arrival side ---
+
+    def begin_response(self):
+        """Close out the previous response's jitter and adapt the prebuffer."""
+        if self._arrival_t0 is not None:
+            self._adapt()
+            self._late_history.append(self._peak_late)
+        self._arrival_t0 = None
+        self._arrived = 0
+        self._peak_late = 0.0
+        self._play_t0 = None
+        self._written = 0
+
+    def on_delta(self, nbytes, dropped=0, now=None):
+        """Record the arrival of an audio delta of nbytes.
+
+        dropped is what the backlog buffer threw away to fit it.
+        """
+        now = time.monotonic() if now is None else now
+        if self._arrival_t0 is None:
+            self._arrival_t0 = now
+        else:
+            late = now - (self._arrival_t0 + self._arrived / self.bytes_per_sec)
+            if late > self._peak_late:
+                self._peak_late = late
+        self._arrived += nbytes
+        if dropped:
+            self.overruns += 1
+            self.overrun_bytes += dropped
+
+    def _adapt(self):
+        # Starting playback after `late` seconds worth of audio has arrived
+        # would have covered the worst delta of each recent response. Bytes
+        # of audio buffered >= seconds waited while the server streams
+        # faster than real time, so this errs on the safe side.
+        need = max([self._peak_late, *self._late_history]) + self.margin_sec
+        want = int(need * self.bytes_per_sec)
+        want -= want % 2
+        self.prebuffer_bytes = max(self.min_prebuffer_bytes,
+                                   min(self.max_prebuffer_bytes, want))
+
+    # --- Playout side ---
+
+    def ready(self, depth):
+        """True once enough audio is buffered to start playing."""
+        return depth >= self.prebuffer_bytes
+
+    def start(self, now=None):
+        """Anchor the playout clock; call when the prebuffer is satisfied."""
+        self._play_t0 = time.monotonic() if now is None else now
+        self._written = 0
+
+    def wrote(self, nbytes, now=None):
+        """Account for nbytes handed to the sinks; return seconds to sleep."""
+        now = time.monotonic() if now is None else now
+        if self._play_t0 is None:
+            self._play_t0 = now
+        self._written += nbytes
+        dur = nbytes / self.bytes_per_sec
+        ahead = self._play_t0 + self._written / self.bytes_per_sec - now
+        if ahead < dur - self.slack_sec:
+            # Woken too late: the sinks drained before this write landed.
+            # Re-anchor so we don't burst to catch up.
+            self.underruns += 1
+            self._play_t0 = now - self._written / self.bytes_per_sec + dur
+            ahead = dur
+        return max(0.0, ahead - self.lead_sec)
+
+    def queued_sec(self, now=None):
+        """Audio the playout clock says the sinks still hold."""
+        if self._play_t0 is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self._play_t0 + self._written / self.bytes_per_sec - now)
+
+    def starved(self):
+        """Buffer ran empty mid-response; grow the prebuffer and rebuffer."""
+        self.underruns += 1
+        self._peak_late = max(self._peak_late,
+                              1.5 * self.prebuffer_bytes / self.bytes_per_sec)
+        self._adapt()
+        self._play_t0 = None
+        self._written = 0
+
+    # --- Stats ---
+
+    @property
+    def prebuffer_ms(self):
+        return 1000.0 * self.prebuffer_bytes / self.bytes_per_sec
+
+    @property
+    def jitter_ms(self):
+        peaks = list(self._late_history) + [self._peak_late]
+        return 1000.0 * max(peaks)
+
+    def stats(self):
+        return {
+            "prebuffer_ms": round(self.prebuffer_ms),
+            "jitter_ms": round(self.jitter_ms),
+            "underruns": self.underruns,
+            "overruns": self.overruns,
+        }
+
+
+class PlaybackTracker:
+    """Maps reply audio to assistant items and counts what reached the sinks.
+
+    recv() reports received() per delta, the feeder tags each chunk with
+    take(), and sink writer threads report played() after a successful
+    pipe write. played_ms() is what conversation.item.truncate needs.
+    """
+
+    def __init__(self, bytes_per_sec):
+        self.bytes_per_sec = bytes_per_sec
+        self._lock = threading.Lock()
+        self._pending = deque()      # [item_id, bytes] still in the playout buffer
+        self._received = {}          # item_id -> bytes received
+        self._played = {}            # item_id -> {sink: bytes written}
+        self.received_bytes = 0
+        self.played_bytes = 0
+
+    def received(self, item_id, nbytes):
+        if not nbytes:
+            return
+        if self._pending and self._pending[-1][0] == item_id:
+            self._pending[-1][1] += nbytes
+        else:
+            self._pending.append([item_id, nbytes])
+        self._received[item_id] = self._received.get(item_id, 0) + nbytes
+        self.received_bytes += nbytes
+
+    def take(self, nbytes):
+        """Tag the next nbytes leaving the playout buffer: [(item_id, bytes)]."""
+        tag = []
+        while nbytes and self._pending:
+            seg = self._pending[0]
+            n = min(nbytes, seg[1])
+            tag.append((seg[0], n))
+            seg[1] -= n
+            nbytes -= n
+            if not seg[1]:
+                self._pending.popleft()
+        return tag
+
+    def clear_pending(self):
+        """The playout buffer was cleared; its audio will never play."""
+        self._pending.clear()
+
+    def played(self, sink, tag):
+        """Called from a sink writer thread once a tagged chunk is written."""
+        with self._lock:
+            for item_id, n in tag:
+                sinks = self._played.setdefault(item_id, {})
+                before = max(sinks.values(), default=0)
+                sinks[sink] = sinks.get(sink, 0) + n
+                self.played_bytes += max(sinks.values()) - before
+
+    def played_ms(self, item_id):
+        """Milliseconds of item_id that reached the furthest-ahead sink."""
+        with self._lock:
+            n = max(self._played.get(item_id, {}).values(), default=0)
+        return n * 1000 // self.bytes_per_sec
+
+    def unplayed(self):
+        """(item_id, played_ms) for every item with audio that never played."""
+        out = []
+        for item_id, n in self._received.items():
+            ms = self.played_ms(item_id)
+            if ms < n * 1000 // self.bytes_per_sec:
+                out.append((item_id, ms))
+        return out
+
+    def forget(self):
+        """Drop per-item bookkeeping once a turn is settled."""
+        with self._lock:
+            self._received.clear()
+            self._played.clear()
+        self._pending.clear()
+
+    @property
+    def ratio(self):
+        if not self.received_bytes:
+            return 1.0
+        return self.played_bytes / self.received_bytes
+
+    def stats(self):
+        return {
+            "received_ms": self.received_bytes * 1000 // self.bytes_per_sec,
+            "played_ms": self.played_bytes * 1000 // self.bytes_per_sec,
+            "played_ratio": round(self.ratio, 3),
+        }
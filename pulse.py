@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+In-process PulseAudio streams through libpulse-simple (ctypes), no pacat/parec
+- PulseStream: one playback stream per sink; quacks like the pacat Popen
+  SinkWriter expects (stdin.write/flush, poll, kill), so the writer thread,
+  its bounded queue and respawn logic are shared with the subprocess backend
+- PulseRecord: capture stream read on its own thread into an os.pipe(), so
+  MicStream reads it on the event loop exactly like parec's stdout
+- Blocking calls release the GIL and return as soon as the server has room
+  (playback) or a fragment (capture): the server's buffer paces the thread
+- Playback reports stream + sink latency after every write and counts
+  underflows: the buffer drained while the reply was still arriving
+- A failed connect yields a dead stream (poll() != None) instead of raising,
+  so the caller's respawn path retries it
+"""
+
+import ctypes
+import ctypes.util
+import os
+import threading
+import time
+
+PA_STREAM_PLAYBACK = 1
+PA_STREAM_RECORD = 2
+PA_SAMPLE_S16LE = 3
+PA_DEFAULT = 0xFFFFFFFF           # (uint32_t) -1: let the server choose
+UNDERFLOW_GAP_SEC = 1.0           # drained, then more audio within this: an underflow
+
+
+class _SampleSpec(ctypes.Structure):
+    _fields_ = [("format", ctypes.c_int), ("rate", ctypes.c_uint32), ("channels", ctypes.c_uint8)]
+
+
+class _BufferAttr(ctypes.Structure):
+    _fields_ = [("maxlength", ctypes.c_uint32), ("tlength", ctypes.c_uint32),
+                ("prebuf", ctypes.c_uint32), ("minreq", ctypes.c_uint32),
+                ("fragsize", ctypes.c_uint32)]
+
+
+def _load():
+    try:
+        simple = ctypes.CDLL(ctypes.util.find_library("pulse-simple") or "libpulse-simple.so.0")
+        core = ctypes.CDLL(ctypes.util.find_library("pulse") or "libpulse.so.0")
+    except OSError:
+        return None
+    err = ctypes.POINTER(ctypes.c_int)
+    simple.pa_simple_new.restype = ctypes.c_void_p
+    simple.pa_simple_new.argtypes = [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+                                     ctypes.c_char_p, ctypes.POINTER(_SampleSpec), ctypes.c_void_p,
+                                     ctypes.POINTER(_BufferAttr), err]
+    simple.pa_simple_write.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, err]
+    simple.pa_simple_read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, err]
+    simple.pa_simple_get_latency.restype = ctypes.c_uint64
+    simple.pa_simple_get_latency.argtypes = [ctypes.c_void_p, err]
+    simple.pa_simple_free.argtypes = [ctypes.c_void_p]
+    core.pa_strerror.restype = ctypes.c_char_p
+    core.pa_strerror.argtypes = [ctypes.c_int]
+    simple.pa_strerror = core.pa_strerror
+    return simple
+
+
+_lib = None
+_tried = False
+
+
+def lib():
+    global _lib, _tried
+    if not _tried:
+        _lib, _tried = _load(), True
+    return _lib
+
+
+def available():
+    return lib() is not None
+
+
+class PulseError(OSError):
+    pass
+
+
+class _Simple:
+    """A pa_simple handle: I/O on one thread, kill() from any."""
+
+    def __init__(self, direction, device, rate, channels, attr, name):
+        self._lib = lib()
+        self._lock = threading.Lock()
+        self._handle = None
+        self._dead = False
+        self.returncode = None
+        self.error = None
+        spec = _SampleSpec(PA_SAMPLE_S16LE, rate, channels)
+        err = ctypes.c_int(0)
+        handle = self._lib.pa_simple_new(
+            None, b"sparky", direction, device.encode() if device else None,
+            name.encode(), ctypes.byref(spec), None, ctypes.byref(attr), ctypes.byref(err))
+        if not handle:
+            self._fail(err.value)
+        else:
+            self._handle = handle
+
+    def _fail(self, code):
+        self.error = self._lib.pa_strerror(code).decode(errors="replace")
+        self.returncode = 1
+        self._dead = True
+
+    def _call(self, fn, *args):
+        """Run a pa_simple call unless killed; frees the handle if kill() came meanwhile."""
+        err = ctypes.c_int(0)
+        with self._lock:
+            if self._dead:
+                raise PulseError(self.error or "stream closed")
+            r = fn(self._handle, *args, ctypes.byref(err))
+            if fn is self._lib.pa_simple_get_latency:
+                failed = r == 0xFFFFFFFFFFFFFFFF
+            else:
+                failed = r < 0
+            if failed:
+                self._fail(err.value)
+            if self._dead:
+                self._free()
+        if failed:
+            raise PulseError(self.error)
+        return r
+
+    def _free(self):
+        if self._handle:
+            self._lib.pa_simple_free(self._handle)
+            self._handle = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            self.returncode = -9
+        self._dead = True
+        # Free now unless a blocking call is in flight; then _call frees it
+        if self._lock.acquire(blocking=False):
+            try:
+                self._free()
+            finally:
+                self._lock.release()
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+class PulseStream(_Simple):
+    """Playback stream for one sink, used by SinkWriter in place of pacat."""
+
+    def __init__(self, sink, rate=24000, channels=1, latency_msec=50):
+        frame = 2 * channels
+        attr = _BufferAttr(PA_DEFAULT, rate * frame * latency_msec // 1000,
+                           PA_DEFAULT, PA_DEFAULT, PA_DEFAULT)
+        super().__init__(PA_STREAM_PLAYBACK, sink, rate, channels, attr, "Sparky voice")
+        self.sink = sink
+        self.latency_ms = None
+        self.underflows = 0
+        self._drained_at = None   # monotonic time the buffer ran out, per the last latency
+
+    @property
+    def stdin(self):
+        return self
+
+    def write(self, data):
+        now = time.monotonic()
+        if self._drained_at is not None and self._drained_at < now < self._drained_at + UNDERFLOW_GAP_SEC:
+            self.underflows += 1
+        data = bytes(data)   # no copy for the bytes SpeakerFanout hands out
+        self._call(self._lib.pa_simple_write, data, len(data))
+        usec = self._call(self._lib.pa_simple_get_latency)
+        self.latency_ms = usec / 1000.0
+        self._drained_at = time.monotonic() + usec / 1e6
+        return len(data)
+
+    def flush(self):
+        # pa_simple_write has already handed the data to the server
+        pass
+
+
+class PulseRecord(_Simple):
+    """Capture stream pumped into a pipe; .stdout is read like parec's."""
+
+    def __init__(self, source, rate=24000, channels=1, latency_msec=100, fragment_msec=20):
+        frame = 2 * channels
+        self.fragment = rate * frame * fragment_msec // 1000
+        attr = _BufferAttr(PA_DEFAULT, PA_DEFAULT, PA_DEFAULT, PA_DEFAULT,
+                           rate * frame * latency_msec // 1000)
+        super().__init__(PA_STREAM_RECORD, source, rate, channels, attr, "Sparky mic")
+        rfd, self._wfd = os.pipe()
+        self.stdout = os.fdopen(rfd, "rb", buffering=0)
+        self._thread = threading.Thread(target=self._pump, name=f"pulse-rec-{source}", daemon=True)
+        self._thread.start()
+
+    def _pump(self):
+        buf = (ctypes.c_char * self.fragment)()
+        view = memoryview(buf).cast("B")
+        try:
+            while not self._dead:
+                self._call(self._lib.pa_simple_read, buf, self.fragment)
+                os.write(self._wfd, view)
+        except OSError:
+            pass
+        finally:
+            # EOF for the reader, as when parec exits
+            os.close(self._wfd)
+            if self.returncode is None:
+                self.returncode = 1
+
+
+def spawn_playback(sink, rate=24000, latency_msec=50):
+    """SinkWriter spawn hook: a PulseStream for sink (dead if it could not connect)."""
+    stream = PulseStream(sink, rate=rate, latency_msec=latency_msec)
+    if stream.error:
+        print(f"[Speaker {sink}: {stream.error}]")
+    return stream
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Record-and-replay harness - benchmark without a key, a webcam or USB speakers
+- SPARKY_RECORD_DIR=dir: a live session writes events.jsonl (server and
+  client events with timing) and mic.pcm (raw parec audio) into dir
+- python replay.py serve dir [--speed 2] [--port 8765]: mock Realtime server
+  replaying the recorded server events with original or scaled timing
+- SPARKY_REPLAY_DIR=dir + OPENAI_REALTIME_URL=ws://127.0.0.1:8765/v1/realtime:
+  the entry scripts swap parec/pacat for the file-backed stand-ins below
+- python replay.py parec FILE / pacat [OUT]: the stand-ins, paced in real time
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import websockets
+
+REPLAY_PY = os.path.abspath(__file__)
+AUDIO_RATE = 24000
+S16LE_BYTES = 2
+CHUNK_BYTES = AUDIO_RATE * S16LE_BYTES // 20   # 50ms
+
+
+# --- Recording ---
+
+class Recorder:
+    """Writes a session's websocket events and mic PCM to a directory."""
+
+    def __init__(self, out_dir):
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self._events = open(os.path.join(out_dir, "events.jsonl"), "w", buffering=1)
+        self._mic = open(os.path.join(out_dir, "mic.pcm"), "wb")
+        self._t0 = time.monotonic()
+
+    def _log(self, direction, raw):
+        t = time.monotonic() - self._t0
+        # raw is already JSON text; embed it rather than re-serializing
+        self._events.write(f'{{"t": {t:.4f}, "dir": "{direction}", "event": {raw}}}\n')
+
+    def received(self, raw):
+        self._log("recv", raw)
+
+    def sent(self, raw):
+        if '"input_audio_buffer.append"' in raw[:64]:
+            # The audio itself is in mic.pcm
+            raw = json.dumps({"type": "input_audio_buffer.append"})
+        self._log("send", raw)
+
+    def mic(self, data):
+        self._mic.write(data)
+
+    def close(self):
+        self._events.close()
+        self._mic.close()
+
+
+class RecordingSocket:
+    """Websocket wrapper that logs everything sent and received."""
+
+    def __init__(self, ws, recorder):
+        self._ws = ws
+        self._rec = recorder
+
+    async def send(self, raw):
+        self._rec.sent(raw)
+        await self._ws.send(raw)
+
+    async def recv(self):
+        raw = await self._ws.recv()
+        self._rec.received(raw)
+        return raw
+
+    def __getattr__(self, name):
+        return getattr(self._ws, name)
+
+
+# --- File-backed PulseAudio stand-ins ---
+
+def fake_sinks(n=1):
+    return [f"replay-usb-{i}" for i in range(n)]
+
+
+def parec_cmd(replay_dir):
+    """Command line for a parec stand-in playing replay_dir/mic.pcm."""
+    return [sys.executable, REPLAY_PY, "parec", os.path.join(replay_dir, "mic.pcm")]
+
+
+def spawn_pacat(sink, **_):
+    """Drop-in for speakers.spawn_pacat that consumes audio in real time."""
+    return subprocess.Popen([sys.executable, REPLAY_PY, "pacat"],
+                            stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+def run_parec(path, loop=False):
+    """Write the file to stdout at real-time pace, then silence."""
+    out = sys.stdout.buffer
+    silence = bytes(CHUNK_BYTES)
+    t0 = time.monotonic()
+    sent = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_BYTES)
+            if not chunk:
+                if loop:
+                    f.seek(0)
+                    continue
+                chunk = silence
+            out.write(chunk)
+            out.flush()
+            sent += len(chunk)
+            delay = t0 + sent / (AUDIO_RATE * S16LE_BYTES) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+
+def run_pacat(out_path=None):
+    """Consume stdin at real-time pace like a sink would; optionally save it."""
+    inp = sys.stdin.buffer
+    out = open(out_path, "wb") if out_path else None
+    t0 = None
+    played = 0
+    while True:
+        chunk = inp.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        if out:
+            out.write(chunk)
+        now = time.monotonic()
+        if t0 is None or t0 + played / (AUDIO_RATE * S16LE_BYTES) < now:
+            t0, played = now, 0   # sink ran dry; restart its clock
+        played += len(chunk)
+        delay = t0 + played / (AUDIO_RATE * S16LE_BYTES) - now
+        if delay > 0.05:
+            time.sleep(delay - 0.05)   # keep ~50ms queued, like --latency-msec=50
+
+
+# --- Mock Realtime server ---
+
+def load_events(replay_dir):
+    events = []
+    with open(os.path.join(replay_dir, "events.jsonl")) as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec["dir"] == "recv":
+                events.append((rec["t"], json.dumps(rec["event"])))
+    return events
+
+
+async def serve(replay_dir, host="127.0.0.1", port=8765, speed=1.0):
+    events = load_events(replay_dir)
+    print(f"Replaying {len(events)} events from {replay_dir} at {speed or 'max'}x on ws://{host}:{port}")
+
+    async def handler(conn):
+        counts = {}
+
+        async def drain():
+            try:
+                async for raw in conn:
+                    t = json.loads(raw).get("type", "?")
+                    counts[t] = counts.get(t, 0) + 1
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+        client = asyncio.create_task(drain())
+        t0 = time.monotonic()
+        try:
+            for t, raw in events:
+                if speed > 0:
+                    delay = t / speed - (time.monotonic() - t0)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await conn.send(raw)
+            print(f"[Replay done in {time.monotonic() - t0:.2f}s] client sent: {counts}")
+            await client
+        except websockets.exceptions.ConnectionClosed:
+            print(f"[Client left] client sent: {counts}")
+        finally:
+            client.cancel()
+
+    async with websockets.serve(handler, host, port, max_size=None):
+        await asyncio.Future()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("serve", help="mock Realtime server")
+    p.add_argument("dir")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--speed", type=float, default=1.0, help="timing scale; 0 = as fast as possible")
+    p = sub.add_parser("parec", help="parec stand-in")
+    p.add_argument("file")
+    p.add_argument("--loop", action="store_true")
+    p = sub.add_parser("pacat", help="pacat stand-in")
+    p.add_argument("out", nargs="?")
+    args = ap.parse_args()
+
+    try:
+        if args.cmd == "serve":
+            asyncio.run(serve(args.dir, args.host, args.port, args.speed))
+        elif args.cmd == "parec":
+            run_parec(args.file, args.loop)
+        else:
+            run_pacat(args.out)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
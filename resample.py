@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Streaming polyphase resampler for native-rate mic capture
+- parec reads the device at its own rate and channel count; this turns
+  that into the 24kHz s16le mono the rest of the pipeline expects
+- Channels are downmixed (mean) or one is picked before filtering
+- Kaiser-windowed sinc split into L phases for a rational L/M ratio; each
+  output sample is one dot product over taps input samples
+- Filter history and output phase carry across calls, and a frame split
+  between two pipe reads is held back, so any chunking gives the same output
+- Added latency is about taps/2 input samples (0.5ms at 48kHz, 48 taps)
+"""
+
+import math
+import time
+
+try:
+    import numpy as np
+except ImportError:  # voice-only installs may not have NumPy
+    np = None
+
+
+def available():
+    return np is not None
+
+
+def design_filter(up, down, taps, rolloff=0.9, beta=8.0):
+    """Prototype low-pass as (up, taps) phases, phase p = h[p::up], reversed."""
+    n = up * taps
+    cutoff = 0.5 * rolloff / max(up, down)        # cycles per upsampled sample
+    t = np.arange(n) - (n - 1) / 2.0
+    h = 2.0 * cutoff * np.sinc(2.0 * cutoff * t) * np.kaiser(n, beta)
+    h *= up / h.sum()
+    # Reversed so phase p dotted with x[base - taps + 1 .. base] is the convolution
+    return np.ascontiguousarray(h.reshape(taps, up).T[:, ::-1], dtype=np.float32)
+
+
+class PolyphaseResampler:
+    """s16le interleaved at in_rate -> s16le mono at out_rate, chunk by chunk."""
+
+    def __init__(self, in_rate, out_rate=24000, channels=1, pick=None, taps=48):
+        if np is None:
+            raise RuntimeError("PolyphaseResampler needs NumPy")
+        if pick is not None and not 0 <= pick < channels:
+            raise ValueError(f"channel {pick} out of range for {channels} channels")
+        g = math.gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.pick = pick
+        self.taps = taps
+        self.up = out_rate // g
+        self.down = in_rate // g
+        self.frame_bytes = 2 * channels
+        self._bank = design_filter(self.up, self.down, taps)
+        self._hist = np.zeros(taps - 1, dtype=np.float32)
+        self._partial = b""
+        # Position of the next output, in 1/up input samples from the start
+        # of history + new input
+        self._next = (taps - 1) * self.up
+
+        self.frames_in = 0
+        self.samples_out = 0
+        self.cpu_ms = 0.0
+
+    @property
+    def delay_ms(self):
+        return (self.taps * self.up - 1) / 2.0 / self.up * 1000.0 / self.in_rate
+
+    def _mono(self, data):
+        if self._partial:
+            data = self._partial + bytes(data)
+        whole = len(data) - len(data) % self.frame_bytes
+        self._partial = bytes(data[whole:])
+        x = np.frombuffer(data, dtype="<i2", count=whole // 2)
+        if self.channels > 1:
+            x = x.reshape(-1, self.channels)
+            x = x[:, self.pick] if self.pick is not None else x.mean(axis=1, dtype=np.float32)
+        return x.astype(np.float32)
+
+    def process(self, data):
+        """Resample whatever whole frames data holds; returns s16le mono bytes."""
+        t0 = time.perf_counter()
+        new = self._mono(data)
+        self.frames_in += len(new)
+        x = np.concatenate((self._hist, new))
+        up, down, taps = self.up, self.down, self.taps
+        count = max(0, -(-(len(x) * up - self._next) // down))
+        out = np.empty(count, dtype=np.float32)
+        if count:
+            windows = np.lib.stride_tricks.sliding_window_view(x, taps)
+            pos = self._next + down * np.arange(count)
+            starts = pos // up - (taps - 1)
+            phases = pos % up
+            # Outputs r, r+up, r+2up... share a phase: one mat-vec each
+            for r in range(min(up, count)):
+                out[r::up] = windows[starts[r::up]] @ self._bank[phases[r]]
+            self._next += count * down
+        keep = len(x) - (taps - 1)
+        self._hist = x[keep:].copy()
+        self._next -= keep * up
+        self.samples_out += count
+        pcm = np.clip(np.rint(out), -32768, 32767).astype("<i2").tobytes()
+        self.cpu_ms += (time.perf_counter() - t0) * 1000.0
+        return pcm
+
+    def reset(self):
+        self._hist[:] = 0.0
+        self._partial = b""
+        self._next = (self.taps - 1) * self.up
+
+    def stats(self):
+        return {
+            "resample": f"{self.in_rate}x{self.channels}->{self.out_rate}",
+            "resample_delay_ms": round(self.delay_ms, 2),
+            "resample_cpu_ms": round(self.cpu_ms, 1),
+        }
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Fixed-capacity PCM ring buffer
+- Preallocated once; writes copy into place, reads hand out memoryviews
+- No memmove of the backlog and no new bytes object per chunk
+- Overflow policy: drop the oldest audio or the newest incoming audio
+"""
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class PcmRing:
+    """Byte ring for s16le PCM with zero-copy reads."""
+
+    def __init__(self, capacity, overflow=DROP_NEWEST, align=2):
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        capacity -= capacity % align
+        self.capacity = capacity
+        self.overflow = overflow
+        self.align = align
+        self._buf = bytearray(capacity)
+        self._mv = memoryview(self._buf)
+        self._scratch = bytearray()
+        self._head = 0   # read position
+        self._len = 0
+        self.dropped_bytes = 0
+        self.overflows = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    def clear(self):
+        self._head = 0
+        self._len = 0
+
+    def write(self, data):
+        """Append data; returns the number of bytes dropped by the policy."""
+        data = memoryview(data)
+        n = len(data)
+        free = self.capacity - self._len
+        dropped = 0
+        if n > free:
+            self.overflows += 1
+            if self.overflow == DROP_NEWEST:
+                dropped = n - free
+                n = free
+                data = data[:n]
+            else:
+                if n > self.capacity:
+                    dropped = n - self.capacity + self._len
+                    data = data[n - self.capacity:]
+                    n = self.capacity
+                    self.clear()
+                over = n - (self.capacity - self._len)
+                if over > 0:
+                    self._head = (self._head + over) % self.capacity
+                    self._len -= over
+                    dropped += over
+            self.dropped_bytes += dropped
+        if n:
+            tail = (self._head + self._len) % self.capacity
+            first = min(n, self.capacity - tail)
+            self._mv[tail:tail + first] = data[:first]
+            if first < n:
+                self._mv[:n - first] = data[first:n]
+            self._len += n
+        return dropped
+
+    def peek(self, n):
+        """Memoryview of up to n buffered bytes, valid until the next write."""
+        n = min(n, self._len)
+        end = self._head + n
+        if end <= self.capacity:
+            return self._mv[self._head:end]
+        # Wrapped: stitch the two halves into a reused scratch buffer
+        if len(self._scratch) < n:
+            self._scratch = bytearray(n)
+        first = self.capacity - self._head
+        scratch = memoryview(self._scratch)
+        scratch[:first] = self._mv[self._head:]
+        scratch[first:n] = self._mv[:n - first]
+        return scratch[:n]
+
+    def consume(self, n):
+        """Discard up to n bytes from the read side."""
+        n = min(n, self._len)
+        self._head = (self._head + n) % self.capacity
+        self._len -= n
+        if not self._len:
+            self._head = 0
+
+    def read(self, n):
+        """peek() and consume() in one step."""
+        view = self.peek(n)
+        self.consume(len(view))
+        return view
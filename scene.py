@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Scene-change gate for camera frame injection
+- Each frame is reduced to a tiny zero-mean grayscale thumbnail (exposure
+  drift cancels out) and compared with the last frame that was sent
+- A big enough difference sends right away (someone stepped up); otherwise
+  a max interval still refreshes the model's view now and then
+- A few hundred bytes of math per check, so it can run several times a second
+- watch() is for idle polling: it diffs consecutive polled frames and
+  leaves the send reference and the sent/skipped counts alone
+"""
+
+import cv2
+import numpy as np
+
+
+class SceneChangeDetector:
+    """Decides whether a camera frame is worth sending to the model."""
+
+    def __init__(self, size=(32, 24), threshold=10.0, min_interval=2.0, max_interval=30.0):
+        self.size = size
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._ref = None
+        self._last_sent = None
+        self._watched = None
+        self.last_diff = 0.0
+        self.checked = 0
+        self.sent = 0
+        self.skipped = 0
+
+    def signature(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        sig = small.astype(np.float32)
+        return sig - sig.mean()
+
+    def check(self, frame, now):
+        """Returns why frame should be sent ("first", "change", "max_interval") or None."""
+        self.checked += 1
+        sig = self.signature(frame)
+        if self._ref is None:
+            reason = "first"
+        else:
+            self.last_diff = float(np.mean(np.abs(sig - self._ref)))
+            since = now - self._last_sent
+            if since < self.min_interval:
+                reason = None
+            elif self.last_diff >= self.threshold:
+                reason = "change"
+            elif since >= self.max_interval:
+                reason = "max_interval"
+            else:
+                reason = None
+        if reason is None:
+            self.skipped += 1
+            return None
+        self._ref = sig
+        self._last_sent = now
+        self.sent += 1
+        return reason
+
+    def watch(self, frame):
+        """Difference from the previous watched frame (0 for the first); nothing is sent."""
+        sig = self.signature(frame)
+        prev, self._watched = self._watched, sig
+        return 0.0 if prev is None else float(np.mean(np.abs(sig - prev)))
+
+    def reset(self):
+        """Next frame counts as "first" (e.g. a new session has not seen any)."""
+        self._ref = None
+        self._watched = None
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "last_diff": round(self.last_diff, 1),
+        }
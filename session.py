@@ -0,0 +1,1185 @@
+#!/usr/bin/env python3
+"""
+Realtime session engine shared by g1_sparky.py and g1_sparky_vision.py
+- The entry scripts bring up the devices (mic source, speaker fan-out,
+  camera) and hand them to a Session; settings are read from cfg, the
+  entry script's module, so its constants stay the one place to tune
+- Stages: Realtime (websocket + event dispatch), Playout (reply buffer,
+  prebuffer, speaker feeder), MicUplink (AEC, local VAD, upload),
+  ContextKeeper, Greeter (phrase cache), IdleMonitor, VisionInjector
+- Stages register handlers per server event type; dispatch runs them in
+  registration order
+- Each stage is handed what it uses (cfg, SessionState, Realtime, its
+  devices, Playout its ring and scheduler); calls between stages go
+  through hooks Session wires, so a stage can be driven, tested or
+  profiled on its own
+- start_speakers/start_mic/mic_stream/open_camera: device bring-up for one
+  station
+"""
+
+import asyncio
+import base64
+import json
+import random
+import subprocess
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import websockets
+
+import aec
+import prompts
+import pulse
+import replay
+import resample
+import vad
+from context import ContextWindow
+from latency import TurnTimeline
+from mic import MicStream
+from phrases import PhraseCache
+from playout import PlayoutScheduler, PlaybackTracker
+from ringbuf import PcmRing
+from speakers import SpeakerFanout, spawn_pacat, find_usb_sinks
+
+
+def session_update(cfg, prompt_text):
+    """session.update JSON, re-sent on every connect."""
+    return json.dumps({
+        "type": "session.update",
+        "session": {
+            "modalities": ["audio", "text"],
+            "instructions": "You must ONLY respond in English. Never speak Spanish or any other language.\n\n" + prompt_text,
+            "voice": cfg.VOICE,
+            "input_audio_format": "pcm16",
+            "output_audio_format": "pcm16",
+            "input_audio_transcription": {"model": "whisper-1", "language": "en"},
+            "turn_detection": {
+                "type": "server_vad",
+                "threshold": 0.65,
+                "prefix_padding_ms": cfg.VAD_PREFIX_PADDING_MS,
+                "silence_duration_ms": cfg.VAD_SILENCE_MS
+            }
+        }
+    })
+
+
+def audio_append(data):
+    return json.dumps({
+        "type": "input_audio_buffer.append",
+        "audio": base64.b64encode(data).decode(),
+    })
+
+
+def jpeg_to_data_url(jpeg: bytes) -> str:
+    b64 = base64.b64encode(jpeg).decode("ascii")
+    return f"data:image/jpeg;base64,{b64}"
+
+
+def image_item_event(data_url: str, item_id: str) -> str:
+    """conversation.item.create carrying one camera frame, as JSON text."""
+    return json.dumps({
+        "type": "conversation.item.create",
+        "item": {
+            "id": item_id,
+            "type": "message",
+            "role": "user",
+            "content": [
+                {
+                    "type": "input_image",
+                    "image_url": data_url
+                },
+                {
+                    "type": "input_text",
+                    "text": "(Latest camera frame - use this to see who you're talking to. Don't mention receiving an image unless asked what you see.)"
+                }
+            ]
+        }
+    })
+
+
+# --- Device bring-up ---
+
+def use_libpulse(cfg):
+    """In-process libpulse streams instead of pacat/parec (never when replaying)."""
+    return cfg.AUDIO_BACKEND == "libpulse" and not cfg.REPLAY_DIR and pulse.available()
+
+
+async def start_speakers(cfg, sinks=None):
+    """(sinks, tracker, speakers) with a stream open per sink, or None."""
+    # USB speaker sinks (or file-backed stand-ins when replaying)
+    if cfg.REPLAY_DIR:
+        sinks = replay.fake_sinks(cfg.REPLAY_SINKS)
+    elif not sinks:
+        sinks = await asyncio.to_thread(find_usb_sinks)
+    if not sinks:
+        return None
+    # One playback stream (pacat or libpulse) + writer thread per USB speaker
+    # sink; writers report what actually reached each sink so interruptions
+    # truncate correctly
+    tracker = PlaybackTracker(cfg.AUDIO_RATE * cfg.S16LE_BYTES)
+    if cfg.REPLAY_DIR:
+        spawn = replay.spawn_pacat
+    elif use_libpulse(cfg):
+        spawn = pulse.spawn_playback
+        print("Audio backend: libpulse")
+    else:
+        spawn = spawn_pacat
+        if cfg.AUDIO_BACKEND == "libpulse":
+            print("Audio backend: libpulse-simple not found, using pacat/parec")
+    speakers = SpeakerFanout(sinks, spawn=spawn, on_played=tracker.played,
+                             delays_ms=cfg.SINK_DELAYS_MS, correct_drift=cfg.SINK_DRIFT_CORRECTION)
+    await asyncio.to_thread(speakers.start)
+    return sinks, tracker, speakers
+
+
+def native_capture(cfg):
+    """True when parec reads the mic at its own rate and we resample here."""
+    return bool(cfg.MIC_CAPTURE_RATE) and not cfg.REPLAY_DIR and resample.available()
+
+
+async def start_mic(cfg):
+    """Capture (parec or libpulse) on cfg.PA_MIC_SOURCE once it is up, or None."""
+    if native_capture(cfg):
+        # Device rate and channels as they are; no PulseAudio resampler
+        rate, channels = cfg.MIC_CAPTURE_RATE, cfg.MIC_CAPTURE_CHANNELS
+    else:
+        if cfg.MIC_CAPTURE_RATE and not cfg.REPLAY_DIR:
+            print("Native mic capture: off (NumPy not installed)")
+        rate, channels = cfg.AUDIO_RATE, 1
+    if use_libpulse(cfg):
+        source = cfg.PA_MIC_SOURCE
+        proc = await asyncio.to_thread(pulse.PulseRecord, source, rate, channels, latency_msec=100)
+        if proc.error:
+            print(f"Mic: {source}: {proc.error}")
+            return None
+    else:
+        mic_cmd = ["parec", "--device", cfg.PA_MIC_SOURCE,
+                   "--format=s16le", f"--channels={channels}", f"--rate={rate}",
+                   "--latency-msec=100"]
+        if cfg.REPLAY_DIR:
+            mic_cmd = replay.parec_cmd(cfg.REPLAY_DIR)
+        proc = subprocess.Popen(mic_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        await asyncio.sleep(0.3)
+        if proc.poll() is not None:
+            return None
+        source = cfg.PA_MIC_SOURCE if not cfg.REPLAY_DIR else mic_cmd[-1]
+    if rate != cfg.AUDIO_RATE or channels != 1:
+        print(f"Mic: {source} at {rate}Hz x{channels} -> 24kHz (resampled here)")
+    else:
+        print(f"Mic: {source} -> 24kHz")
+    return proc
+
+
+def mic_stream(cfg, proc):
+    """MicStream over parec's stdout, resampling if start_mic() captured natively."""
+    resampler = None
+    if native_capture(cfg):
+        resampler = resample.PolyphaseResampler(
+            cfg.MIC_CAPTURE_RATE, cfg.AUDIO_RATE, cfg.MIC_CAPTURE_CHANNELS,
+            pick=cfg.MIC_CHANNEL, taps=cfg.MIC_RESAMPLE_TAPS)
+    return MicStream(proc.stdout, cfg.MIC_CHUNK_BYTES, cfg.MIC_MAX_LATENCY_BYTES,
+                     resampler=resampler)
+
+
+def open_camera(cfg):
+    """Worker thread: (camera, scene, encoder), or None to run voice-only."""
+    # The OpenCV/NumPy imports and warmup frames happen here
+    try:
+        from camera import Camera
+        from scene import SceneChangeDetector
+        from imgenc import AdaptiveEncoder
+    except Exception as e:   # missing, or an OpenCV build without what they use
+        print(f"WARNING: {e}")
+        return None
+    print(f"Opening camera {cfg.CAMERA_DEVICE}...")
+    camera = Camera(cfg.CAMERA_DEVICE, cfg.CAMERA_WIDTH, cfg.CAMERA_HEIGHT, mjpeg=cfg.CAMERA_MJPEG)
+    try:
+        if not camera.open():
+            return None
+        scene = SceneChangeDetector(
+            threshold=cfg.SCENE_CHANGE_THRESHOLD,
+            min_interval=cfg.IMAGE_MIN_INTERVAL, max_interval=cfg.IMAGE_MAX_INTERVAL)
+        encoder = AdaptiveEncoder(
+            max_bytes=cfg.FRAME_MAX_BYTES, max_tokens=cfg.FRAME_MAX_TOKENS,
+            start_quality=cfg.JPEG_QUALITY, crop=cfg.FRAME_CROP)
+    except Exception as e:
+        # Any OpenCV/encoder setup failure means no camera, not no robot
+        print(f"WARNING: camera setup failed: {type(e).__name__}: {e}")
+        try:
+            camera.stop()
+        except Exception:
+            pass
+        return None
+    return camera, scene, encoder
+
+
+class SessionState:
+    """Flags every stage reads and writes; one per Session."""
+
+    def __init__(self):
+        self.running = True
+        self.mic_on = True             # half duplex: off while Sparky talks
+        self.prebuffered = False       # feeder is playing, not filling the prebuffer
+        self.response_active = False   # between response.created and its audio done
+        self.idle = False              # session closed, local monitor only
+        self.last_speech = time.monotonic()
+        self.last_motion = time.monotonic()
+        self.local_until = 0.0         # a cached phrase is still playing until then
+        self.turn_extra = {}           # added to each latency log record
+
+    @property
+    def last_activity(self):
+        return max(self.last_speech, self.last_motion)
+
+
+# --- Stages ---
+
+class Realtime:
+    """The websocket: connect with backoff, send, dispatch server events."""
+
+    def __init__(self, cfg, session_update, recorder=None):
+        self.cfg = cfg
+        self.url = f"{cfg.REALTIME_URL}?model={cfg.MODEL}"
+        self.headers = {
+            "Authorization": f"Bearer {cfg.OPENAI_API_KEY}",
+            "OpenAI-Beta": "realtime=v1",
+        }
+        self.session_update = session_update
+        self.recorder = recorder
+        self.ws = None
+        self._handlers = {}
+        self.bytes_up = 0
+        self.bytes_down = 0
+
+    def on(self, types, handler):
+        """Run async handler(msg) for each server event of the given type(s)."""
+        if isinstance(types, str):
+            types = (types,)
+        for t in types:
+            self._handlers.setdefault(t, []).append(handler)
+
+    async def connect(self):
+        """Open a session, retrying with jittered exponential backoff."""
+        attempt = 0
+        while True:
+            try:
+                sock = await websockets.connect(self.url, additional_headers=self.headers,
+                                                ping_timeout=30, close_timeout=5)
+                return sock, attempt
+            except Exception as e:
+                delay = random.uniform(0, min(self.cfg.RECONNECT_MAX_SEC,
+                                              self.cfg.RECONNECT_BASE_SEC * 2 ** attempt))
+                attempt += 1
+                print(f"[Connect failed: {e}] retry {attempt} in {delay * 1000:.0f}ms")
+                await asyncio.sleep(delay)
+
+    def attach(self, sock):
+        self.ws = replay.RecordingSocket(sock, self.recorder) if self.recorder else sock
+
+    async def send(self, raw):
+        """Send on the current session; dropped while reconnecting."""
+        if self.ws is None:
+            return False
+        try:
+            await self.ws.send(raw)
+            self.bytes_up += len(raw)
+            return True
+        except websockets.exceptions.ConnectionClosed:
+            return False
+
+    async def dispatch(self, msg):
+        for handler in self._handlers.get(msg.get("type"), ()):
+            await handler(msg)
+
+    async def recv(self, state):
+        while state.running:
+            try:
+                raw = await self.ws.recv()
+                self.bytes_down += len(raw)
+                await self.dispatch(json.loads(raw))
+            except websockets.exceptions.ConnectionClosed:
+                print("Connection closed")
+                break
+            except Exception as e:
+                print(f"Recv error: {e}")
+                break
+
+
+class Playout:
+    """Reply audio: playout buffer, adaptive prebuffer and the speaker feeder."""
+
+    def __init__(self, cfg, state, rt, buf, scheduler, speakers, tracker, timeline, echo=None):
+        self.cfg = cfg
+        self.state = state
+        self.rt = rt
+        self.buf = buf
+        self.scheduler = scheduler
+        self.speakers = speakers
+        self.tracker = tracker
+        self.timeline = timeline
+        self.echo = echo
+        self.ready = asyncio.Event()
+        self.cut = False           # reply interrupted: its late deltas are dropped until the next one
+        # Hooks Session wires to the other stages
+        self.on_audio = None       # (pcm) for each reply delta that is played
+        self.on_drained = None     # async (): half duplex, the reply has left the speakers
+        self.mic_stats = None      # (): dict for the per-reply report
+
+    def register(self, rt):
+        rt.on("response.created", self.on_response_created)
+        rt.on(("response.audio.delta", "response.output_audio.delta"), self.on_audio_delta)
+        rt.on(("response.audio.done", "response.output_audio.done", "response.done"),
+              self.on_audio_done)
+        rt.on("input_audio_buffer.speech_started", self.on_speech_started)
+
+    # --- Write to all speakers (enqueue only, never blocks) ---
+
+    def write_speakers(self, data, tag=None):
+        self.speakers.write(data, tag)
+        if self.echo:
+            self.echo.far_end(data)
+
+    def enqueue(self, pcm, item_id):
+        """Queue reply audio; item_id None for audio the server never sent."""
+        dropped = self.buf.write(pcm)
+        self.tracker.received(item_id, len(pcm) - dropped)
+        self.ready.set()
+        return dropped
+
+    def flush(self):
+        """Stop whatever is playing or queued right now, and what is still on the wire."""
+        # Set before any await: every delta up to the next response.created
+        # is the cut-off reply's, and with response_active already off the
+        # feeder would play it straight away
+        self.cut = True
+        self.buf.clear()
+        self.tracker.clear_pending()
+        self.speakers.flush()
+        if self.echo:
+            self.echo.flush_far_end()
+        self.state.prebuffered = False
+
+    async def truncate_unplayed(self):
+        # Cut the server's copy of the reply down to what was heard
+        for item_id, ms in self.tracker.unplayed():
+            if not item_id:
+                continue
+            await self.rt.send(json.dumps({
+                "type": "conversation.item.truncate",
+                "item_id": item_id,
+                "content_index": 0,
+                "audio_end_ms": ms,
+            }))
+            print(f"[Truncated reply at {ms}ms]")
+        self.tracker.forget()
+
+    async def barge_in(self):
+        print("\n[Barge-in]")
+        self.flush()
+        if self.state.response_active:
+            self.state.response_active = False
+            await self.rt.send(json.dumps({"type": "response.cancel"}))
+        await self.truncate_unplayed()
+
+    def finish_turn(self):
+        rec = self.timeline.end_turn(**self.state.turn_extra)
+        if rec and "first_write" in rec["ms"]:
+            h = self.timeline.summary("first_write")
+            print(f"[Latency] speech end -> first audio {rec['ms']['first_write']:.0f}ms "
+                  f"(p50 {h['p50']:.0f} / p95 {h['p95']:.0f} / p99 {h['p99']:.0f}, n={h['n']})")
+
+    def reset(self):
+        self.buf.clear()
+        self.tracker.forget()
+        self.cut = False
+        self.speakers.flush()
+        if self.echo:
+            self.echo.flush_far_end()
+        if self.timeline.active:
+            self.timeline.end_turn(interrupted=True)
+        self.ready.set()
+
+    # --- Speaker feeder ---
+
+    async def wait_audio(self, timeout=0.1):
+        self.ready.clear()
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def feeder(self):
+        state, buf, scheduler = self.state, self.buf, self.scheduler
+        chunk = self.cfg.SPEAKER_CHUNK_BYTES
+        while state.running:
+            if not state.prebuffered:
+                # A reply shorter than the prebuffer plays once it is complete
+                if scheduler.ready(len(buf)) or (buf and not state.response_active):
+                    state.prebuffered = True
+                    scheduler.start()
+                    self.timeline.mark("prebuffered")
+                    print(f"[Prebuffer OK - playing] ({scheduler.prebuffer_ms:.0f}ms)")
+                else:
+                    await self.wait_audio()
+                    continue
+
+            n = min(len(buf), chunk)
+            if n == chunk or (n and not state.response_active):
+                # Zero-copy view; valid until recv() next writes the ring
+                self.write_speakers(buf.read(n), self.tracker.take(n))
+                self.timeline.mark("first_write")
+                self.timeline.mark_last("last_write")
+                await asyncio.sleep(scheduler.wrote(n))
+            else:
+                queued = scheduler.queued_sec()
+                if state.response_active and queued > scheduler.slack_sec:
+                    # Ring empty but the sinks still play the lead: only
+                    # starved if nothing arrives before that runs out
+                    await self.wait_audio(min(0.1, queued))
+                    continue
+                if state.response_active:
+                    scheduler.starved()
+                    state.prebuffered = False
+                    print(f"[Underrun - rebuffering] ({scheduler.prebuffer_ms:.0f}ms)")
+                elif self.echo:
+                    state.prebuffered = False  # reply fully played
+                    self.timeline.mark("mic_reopen")
+                    self.finish_turn()
+                await self.wait_audio()
+
+    # --- Server events ---
+
+    def mute_mic(self):
+        if self.state.mic_on and not self.echo:
+            self.state.mic_on = False
+            print("[Mic muted]")
+
+    async def on_response_created(self, msg):
+        state = self.state
+        if not (self.buf and time.monotonic() < state.local_until):
+            # (a cached greeting still playing keeps its place ahead of the reply)
+            self.buf.clear()
+            self.tracker.forget()
+            state.prebuffered = False
+        self.cut = False
+        self.scheduler.begin_response()
+        self.timeline.mark("response_created")
+        state.response_active = True
+        self.mute_mic()
+
+    async def on_audio_delta(self, msg):
+        if self.cut:
+            return  # the user cut this reply off
+        self.mute_mic()
+        b64 = msg.get("delta") or msg.get("audio") or ""
+        if b64:
+            self.timeline.mark("first_delta")
+            pcm = base64.b64decode(b64)
+            if self.on_audio:
+                self.on_audio(pcm)
+            dropped = self.enqueue(pcm, msg.get("item_id"))
+            self.scheduler.on_delta(len(pcm), dropped)
+
+    async def on_audio_done(self, msg):
+        state, cfg = self.state, self.cfg
+        if not state.response_active:
+            return  # already handled, skip duplicate
+        state.response_active = False
+        self.ready.set()
+        if not self.echo:
+            t0 = time.monotonic()
+            while len(self.buf) > 0 and time.monotonic() - t0 < 10:
+                await asyncio.sleep(0.02)
+            # Wait out what the sinks still hold instead of a fixed sleep
+            t1 = time.monotonic()
+            tail = self.speakers.remaining_sec()
+            await asyncio.sleep(tail + cfg.DRAIN_GUARD_SEC)
+            gap = time.monotonic() - t1
+            print(f"[Speakers quiet] tail={tail * 1000:.0f}ms "
+                  f"gap={gap * 1000:.0f}ms saved={(cfg.FIXED_GAP_SEC - gap) * 1000:.0f}ms")
+            if self.on_drained:
+                await self.on_drained()
+            state.prebuffered = False
+            state.mic_on = True
+            self.timeline.mark("mic_reopen")
+            self.finish_turn()
+        st = self.scheduler.stats()
+        ps = self.tracker.stats()
+        print(f"[Playout] prebuffer={st['prebuffer_ms']}ms jitter={st['jitter_ms']}ms "
+              f"underruns={st['underruns']} overruns={st['overruns']} "
+              f"played={ps['played_ratio']:.0%} of {ps['received_ms']}ms received")
+        ms = self.mic_stats() if self.mic_stats else None
+        if ms:
+            print(f"[Mic] chunks={ms['chunks']} dropped={ms['dropped_bytes']}B "
+                  f"flushed={ms['flushed_bytes']}B vad_saved={ms['reduction']:.0%}"
+                  + (f" {ms['resample']} delay={ms['resample_delay_ms']}ms "
+                     f"cpu={ms['resample_cpu_ms']}ms" if "resample" in ms else ""))
+        for sink, ss in self.speakers.stats().items():
+            print(f"[Speaker] {sink}: queue={ss['depth']} write={ss['write_ms']}ms "
+                  f"max={ss['write_ms_max']}ms dropped={ss['dropped']} respawns={ss['respawns']}"
+                  + (f" latency={ss['latency_ms']}ms underflows={ss['underflows']}"
+                     if ss["latency_ms"] is not None else "")
+                  + (f" fill={ss['fill_ms']}ms drift={ss['drift_ppm']}ppm "
+                     f"+{ss['inserted']}/-{ss['deleted']} samples"
+                     if ss["drift_ppm"] is not None else ""))
+        print("[Mic on]\n" if not self.echo else "[Reply done]\n")
+
+    async def on_speech_started(self, msg):
+        self.flush()
+        await self.truncate_unplayed()
+        self.state.response_active = False
+        self.state.mic_on = True
+
+
+class MicUplink:
+    """Mic chunks -> AEC -> local VAD gate -> input_audio_buffer.append."""
+
+    def __init__(self, cfg, state, rt, source, echo=None):
+        self.cfg = cfg
+        self.state = state
+        self.rt = rt
+        self.source = source
+        self.echo = echo
+        self.gate = None
+        if cfg.LOCAL_VAD:
+            if vad.available():
+                self.gate = vad.VadGate(
+                    vad.EnergyVad(), cfg.MIC_CHUNK_BYTES * 1000 // (cfg.AUDIO_RATE * cfg.S16LE_BYTES),
+                    preroll_ms=cfg.VAD_PREFIX_PADDING_MS, hangover_ms=cfg.VAD_SILENCE_MS + 300)
+            else:
+                print("Local VAD: off (NumPy not installed)")
+        # Mic audio from while the session is down, replayed on connect
+        self.held = deque(maxlen=max(1, int(cfg.IDLE_HOLD_SEC * cfg.AUDIO_RATE * cfg.S16LE_BYTES)
+                                     // cfg.MIC_CHUNK_BYTES))
+        # Hooks Session wires to the other stages
+        self.on_barge_in = None    # async (): the user talked over Sparky
+        self.on_idle_chunk = None  # (chunk): mic audio while the session is idle
+
+    async def reopen(self):
+        """Half duplex, after a reply: drop what the mic heard of it."""
+        self.source.clear()
+        if self.gate:
+            self.gate.reset()
+        await self.rt.send(json.dumps({
+            "type": "input_audio_buffer.clear"
+        }))
+
+    def reset(self):
+        if self.gate:
+            self.gate.reset()
+
+    def stats(self):
+        st = self.source.stats()
+        st["reduction"] = self.gate.stats()["reduction"] if self.gate else 0.0
+        return st
+
+    async def run(self):
+        state, rt, echo = self.state, self.rt, self.echo
+        recorder = rt.recorder
+        double_talk = 0
+        while state.running:
+            data = await self.source.read()
+            if data is None:
+                print("[Mic stream ended]")
+                break
+            if recorder:
+                recorder.mic(data)
+            if state.idle:
+                # Cheap monitor: one energy check per chunk, nothing uploaded
+                self.held.append(bytes(data))
+                if self.on_idle_chunk:
+                    self.on_idle_chunk(data)
+                continue
+            if echo:
+                data = echo.process(data)
+                if echo.far_active:
+                    # Sparky is talking: only pass the user's voice through
+                    double_talk = double_talk + 1 if echo.double_talk else 0
+                    if double_talk >= self.cfg.BARGE_IN_CHUNKS and (state.prebuffered or state.response_active):
+                        double_talk = 0
+                        if self.on_barge_in:
+                            await self.on_barge_in()
+                    elif not echo.double_talk:
+                        continue
+            if state.mic_on:
+                if self.gate:
+                    data = self.gate.process(data)
+                    if data is None:
+                        continue
+                if rt.ws is None:
+                    self.held.append(bytes(data))  # replayed once the session is back
+                    continue
+                await rt.send(audio_append(data))
+
+    async def replay_held(self):
+        """What was said while the session was down (e.g. the words that woke it)."""
+        if not self.held:
+            return
+        n = sum(len(d) for d in self.held)
+        while self.held:
+            await self.rt.send(audio_append(self.held.popleft()))
+        print(f"[Replayed {n * 1000 // (self.cfg.AUDIO_RATE * self.cfg.S16LE_BYTES)}ms of held mic audio]")
+
+
+class ContextKeeper:
+    """Keeps the server-side conversation bounded (conversation.item.delete)."""
+
+    def __init__(self, cfg, state, rt):
+        self.cfg = cfg
+        self.state = state
+        self.rt = rt
+        self.max_images = getattr(self.cfg, "CONTEXT_MAX_IMAGES", None)
+        self.ctx = self._window()
+
+    def _window(self):
+        if self.max_images is None:
+            return ContextWindow(max_tokens=self.cfg.CONTEXT_MAX_TOKENS,
+                                 keep_items=self.cfg.CONTEXT_KEEP_ITEMS)
+        return ContextWindow(self.max_images, self.cfg.CONTEXT_MAX_TOKENS, self.cfg.CONTEXT_KEEP_ITEMS)
+
+    def register(self, rt):
+        rt.on("response.done", self.on_response_done)
+        rt.on("input_audio_buffer.speech_started", self.on_speech_started)
+        rt.on("input_audio_buffer.speech_stopped", self.on_speech_stopped)
+        rt.on("conversation.item.created", self.on_item_created)
+        rt.on("conversation.item.deleted", self.on_item_deleted)
+
+    @property
+    def turns(self):
+        return self.ctx.stats()["turns"]
+
+    def reset(self):
+        self.ctx = self._window()
+
+    async def delete(self, item_ids):
+        for item_id in item_ids:
+            await self.rt.send(json.dumps({
+                "type": "conversation.item.delete",
+                "item_id": item_id,
+            }))
+
+    async def janitor(self):
+        # Nobody has spoken for a while: the visitor left, and the
+        # next one should not inherit their conversation
+        state = self.state
+        while state.running:
+            await asyncio.sleep(5.0)
+            if (not state.response_active and self.turns
+                    and time.monotonic() - state.last_speech > self.cfg.VISITOR_GONE_SEC):
+                ids = self.ctx.clear()
+                await self.delete(ids)
+                print(f"[Context] visitor gone, deleted {len(ids)} items")
+
+    async def on_response_done(self, msg):
+        self.ctx.response_done(msg.get("response") or {})
+        await self.delete(self.ctx.evict())
+        cs = self.ctx.stats()
+        images = f"images={cs['images']} " if self.max_images is not None else ""
+        print(f"[Context] items={cs['items']} {images}"
+              f"~{cs['tokens']} tokens (server: {cs['input_tokens']} in) "
+              f"deleted={cs['deleted']}")
+
+    async def on_speech_started(self, msg):
+        self.ctx.speech_started(msg.get("item_id"), msg.get("audio_start_ms"))
+
+    async def on_speech_stopped(self, msg):
+        self.ctx.speech_stopped(msg.get("item_id"), msg.get("audio_end_ms"))
+
+    async def on_item_created(self, msg):
+        self.ctx.created(msg.get("item") or {})
+
+    async def on_item_deleted(self, msg):
+        self.ctx.removed(msg.get("item_id"))
+
+
+class Greeter:
+    """Phrase cache: fills it from replies, plays a cached opening line to newcomers."""
+
+    def __init__(self, cfg, state, rt, playout, context):
+        self.cfg = cfg
+        self.state = state
+        self.rt = rt
+        self.playout = playout
+        self.context = context
+        self.phrases = None            # set by load(); off until then
+        self.max_bytes = cfg.PHRASE_MAX_SEC * cfg.AUDIO_RATE * cfg.S16LE_BYTES
+        self.reply_pcm = bytearray()   # this reply's audio; None once too long
+        self.reply_text = ""
+        self.last_greeting = -cfg.GREETING_MIN_INTERVAL
+
+    def register(self, rt):
+        rt.on("response.created", self.on_response_created)
+        rt.on("response.audio_transcript.done", self.on_transcript_done)
+        rt.on("response.done", self.on_response_done)
+        rt.on("input_audio_buffer.speech_stopped", self.on_speech_stopped)
+
+    async def load(self):
+        # Reads index.json and checks every .pcm: off the loop
+        if self.cfg.PHRASE_CACHE_DIR:
+            self.phrases = await asyncio.to_thread(
+                PhraseCache, self.cfg.PHRASE_CACHE_DIR, self.cfg.PHRASE_CACHE_MAX_BYTES,
+                canned=prompts.OPENING_LINES + prompts.CATCHPHRASES)
+
+    def capture(self, pcm):
+        if self.reply_pcm is not None:
+            self.reply_pcm += pcm
+            if len(self.reply_pcm) > self.max_bytes:
+                self.reply_pcm = None
+
+    async def greet(self, reason):
+        # Someone new showed up: start a cached opening line right away.
+        # The model is told it said it, and its reply queues up behind.
+        # Needs AEC, so the mic stays open and Sparky doesn't hear itself.
+        playout, state, cfg = self.playout, self.state, self.cfg
+        now = time.monotonic()
+        if (not self.phrases or not playout.echo or state.response_active or playout.buf
+                or self.context.turns or now - self.last_greeting < cfg.GREETING_MIN_INTERVAL):
+            return
+        # Reading the PCM is file I/O (an SD card on the robot): off the loop.
+        # Claim the slot first so voice and camera don't both start one.
+        last, self.last_greeting = self.last_greeting, now
+        hit = await asyncio.to_thread(self.phrases.pick, prompts.OPENING_LINES, cfg.VOICE, cfg.MODEL)
+        if not hit or state.response_active or playout.buf:
+            self.last_greeting = last
+            return
+        text, pcm = hit
+        now = time.monotonic()
+        playout.enqueue(pcm, None)
+        bytes_per_sec = cfg.AUDIO_RATE * cfg.S16LE_BYTES
+        state.local_until = now + len(pcm) / bytes_per_sec
+        print(f"[Greeting: {reason}] {text} ({len(pcm) * 1000 // bytes_per_sec}ms from cache)")
+        await self.rt.send(json.dumps({
+            "type": "conversation.item.create",
+            "item": {
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "text", "text": text}],
+            },
+        }))
+
+    async def on_response_created(self, msg):
+        self.reply_pcm, self.reply_text = bytearray(), ""
+
+    async def on_transcript_done(self, msg):
+        self.reply_text = msg.get("transcript", "")
+
+    async def on_response_done(self, msg):
+        # Only replies that played out in full are worth keeping
+        if not (self.phrases and self.reply_pcm and self.reply_text
+                and (msg.get("response") or {}).get("status") == "completed"):
+            return
+        text = self.reply_text
+        # Writes the .pcm and index.json: off the loop
+        if await asyncio.to_thread(self.phrases.offer, text, self.cfg.VOICE, self.cfg.MODEL,
+                                   bytes(self.reply_pcm)):
+            ps = self.phrases.stats()
+            print(f"[Phrase cached] {text} ({ps['phrases']} phrases, {ps['kb']}KB)")
+
+    async def on_speech_stopped(self, msg):
+        await self.greet("voice")
+
+
+class IdleMonitor:
+    """Closes the session when nobody is around; wakes it on voice or motion."""
+
+    def __init__(self, cfg, state, rt):
+        self.cfg = cfg
+        self.state = state
+        self.rt = rt
+        # Energy-only detector for idle mode (own noise floor, no gate/AEC)
+        self.detector = None
+        if cfg.IDLE_AFTER_SEC:
+            if vad.available():
+                self.detector = vad.EnergyVad()
+            else:
+                print("Idle mode: off (NumPy not installed)")
+        self.woken = asyncio.Event()
+        self.woke_at = None
+        self.since = time.monotonic()   # start of the current active/idle stretch
+        self.active_sec = 0.0
+        self.idle_sec = 0.0
+        self._voiced = 0
+        # Handshake started on the first hint of someone (one voiced chunk,
+        # a small camera diff) so the wake doesn't wait for TLS + upgrade
+        self.warm = None
+        self._warm_timer = None
+        self.prewarms = 0
+        # Hooks Session wires to the other stages
+        self.on_wake = None        # (): the session is coming back
+        self.on_sleep = None       # (): the session was just closed
+
+    def presence(self):
+        """(active s, idle s, bytes saved estimate from the active traffic rate)"""
+        now = time.monotonic()
+        idle = self.state.idle
+        active = self.active_sec + (0.0 if idle else now - self.since)
+        idle_total = self.idle_sec + (now - self.since if idle else 0.0)
+        rt = self.rt
+        rate = (rt.bytes_up + rt.bytes_down) / active if active else 0.0
+        return active, idle_total, rate * idle_total
+
+    def summary(self):
+        active, idle_total, saved = self.presence()
+        rt = self.rt
+        return (f"active {active:.0f}s / idle {idle_total:.0f}s, "
+                f"traffic {(rt.bytes_up + rt.bytes_down) / 1e6:.1f}MB, saved ~{saved / 1e6:.1f}MB, "
+                f"pre-warmed {self.prewarms}x")
+
+    def listen(self, chunk):
+        """Idle mode mic chunk; a few voiced ones in a row wake the session."""
+        self._voiced = self._voiced + 1 if self.detector(chunk) else 0
+        if self._voiced:
+            self.prewarm()
+        if self._voiced >= self.cfg.IDLE_WAKE_CHUNKS:
+            self.wake("voice")
+
+    def prewarm(self):
+        """Start connecting in case a wake follows; dropped if none does in time."""
+        if self.warm is not None or not self.state.idle:
+            return
+        self.prewarms += 1
+        self.warm = asyncio.create_task(self.rt.connect())
+        self._warm_timer = asyncio.get_running_loop().call_later(
+            self.cfg.IDLE_PREWARM_SEC, self._expire)
+
+    def _expire(self):
+        # A wake that sessions() hasn't picked up yet keeps it
+        if self.state.idle:
+            self.drop_warm()
+
+    def take_warm(self):
+        """The pre-started connect task for sessions(), or None."""
+        warm, self.warm = self.warm, None
+        if self._warm_timer:
+            self._warm_timer.cancel()
+            self._warm_timer = None
+        return warm
+
+    def drop_warm(self):
+        warm = self.take_warm()
+        if warm is None:
+            return
+        if not warm.done():
+            warm.cancel()
+        elif not warm.cancelled() and not warm.exception():
+            asyncio.ensure_future(warm.result()[0].close())
+
+    def wake(self, reason):
+        state = self.state
+        if not state.idle:
+            return
+        now = time.monotonic()
+        print(f"\n[Wake: {reason}] after {now - self.since:.0f}s idle")
+        self.idle_sec += now - self.since
+        self.since = self.woke_at = state.last_speech = now
+        self._voiced = 0
+        state.idle = False
+        if self.on_wake:
+            self.on_wake()
+        self.woken.set()
+
+    async def watch(self):
+        # Nothing has happened for a long time: drop the session and
+        # leave only the local monitor running until someone shows up
+        state, rt = self.state, self.rt
+        while state.running and self.detector:
+            await asyncio.sleep(5.0)
+            now = time.monotonic()
+            if (state.idle or rt.ws is None or state.response_active or state.prebuffered
+                    or now - state.last_activity < self.cfg.IDLE_AFTER_SEC):
+                continue
+            self.active_sec += now - self.since
+            self.since = now
+            state.idle = True
+            self.woken.clear()
+            if self.on_sleep:
+                self.on_sleep()
+            print(f"[Idle] nothing for {self.cfg.IDLE_AFTER_SEC:.0f}s, closing the session "
+                  f"({self.summary()})")
+            await rt.ws.close()
+
+
+class VisionInjector:
+    """Camera frames into the conversation when the scene changes."""
+
+    def __init__(self, cfg, state, rt, context, camera, scene, encoder, pool=None):
+        self.cfg = cfg
+        self.state = state
+        self.rt = rt
+        self.context = context
+        self.camera = camera
+        self.scene = scene
+        self.encoder = encoder
+        # Scene check, JPEG encode, base64 and JSON all run here so the
+        # mic and speaker paths never wait behind a frame. One frame is in
+        # flight at a time, also when the pool is shared between stations.
+        self._own_pool = pool is None
+        self.pool = pool or ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame")
+        self.encode_ms = 0.0       # EWMA
+        self.encode_ms_max = 0.0
+        # Hooks Session wires to the other stages
+        self.on_change = None      # async (): someone stepped up (a scene change was sent)
+        self.on_idle_change = None  # (): idle, and the scene changed
+        self.on_idle_hint = None   # (): idle, and a smaller diff
+
+    def reset(self):
+        self.scene.reset()  # show the new session the room right away
+
+    def prepare_frame(self):
+        """Worker thread: returns (reason, item id, event JSON, encode ms, decision) or None."""
+        snap = self.camera.snapshot()
+        if snap is None:
+            return None
+        reason = self.scene.check(snap.thumbnail(), time.monotonic())
+        if not reason:
+            return None
+        t0 = time.perf_counter()
+        jpeg, dec = self.encoder.encode(snap)
+        if not jpeg:
+            return None
+        item_id = f"img_{uuid.uuid4().hex[:24]}"
+        event = image_item_event(jpeg_to_data_url(jpeg), item_id)
+        return reason, item_id, event, (time.perf_counter() - t0) * 1000.0, dec
+
+    def motion_check(self):
+        """Worker thread, idle mode: "change", "hint" for a smaller diff, or None (nothing is encoded)."""
+        snap = self.camera.snapshot()
+        if snap is None:
+            return None
+        # watch(), not check(): idle polls are not frames sent, and must
+        # not move the reference or count in the sent/skipped stats
+        diff = self.scene.watch(snap.thumbnail())
+        if diff >= self.scene.threshold:
+            return "change"
+        if diff >= self.scene.threshold * self.cfg.IDLE_PREWARM_DIFF:
+            return "hint"
+        return None
+
+    async def run(self):
+        state, rt, cfg = self.state, self.rt, self.cfg
+        loop = asyncio.get_running_loop()
+        while state.running:
+            if state.idle:
+                diff = await loop.run_in_executor(self.pool, self.motion_check)
+                hook = {"change": self.on_idle_change, "hint": self.on_idle_hint}.get(diff)
+                if hook:
+                    hook()
+                await asyncio.sleep(cfg.IDLE_CHECK_INTERVAL)
+                continue
+            if rt.ws is None:
+                # Reconnecting: a frame checked now would be the new
+                # session's "first" one, and it could not be sent
+                await asyncio.sleep(cfg.IMAGE_CHECK_INTERVAL)
+                continue
+            ready = await loop.run_in_executor(self.pool, self.prepare_frame)
+            if ready:
+                reason, item_id, event, ms, dec = ready
+                if reason == "change":
+                    state.last_motion = time.monotonic()
+                    if self.on_change:
+                        await self.on_change()
+                ctx = self.context
+                ctx.ctx.expect(item_id, dec["tokens"])
+                if not await rt.send(event):
+                    # Session dropped meanwhile: the next one gets a fresh first frame
+                    ctx.ctx.unexpect(item_id)
+                    self.scene.reset()
+                    continue
+                if not state.response_active:
+                    await ctx.delete(ctx.ctx.evict())
+                # The frame the model had when it answered, to tune the
+                # encoder budgets against response latency
+                state.turn_extra["frame"] = dict(dec, reason=reason, sent=round(time.time(), 3))
+                self.encode_ms = ms if not self.encode_ms else self.encode_ms + 0.2 * (ms - self.encode_ms)
+                self.encode_ms_max = max(self.encode_ms_max, ms)
+                st = self.scene.stats()
+                cs = self.camera.stats()
+                print(f"[Camera frame sent: {reason}] diff={st['last_diff']} "
+                      f"sent={st['sent']} skipped={st['skipped']} "
+                      f"grabs={cs['grabs']} retrieves={cs['retrieves']} "
+                      f"encode={ms:.1f}ms avg={self.encode_ms:.1f} max={self.encode_ms_max:.1f} "
+                      f"payload={len(event) // 1024}KB")
+                print(f"[Frame] {dec['src']} crop={dec['crop']} -> {dec['size']} "
+                      f"q={dec['quality'] or 'camera'} {dec['bytes'] // 1024}KB "
+                      f"~{dec['tokens']} tokens tries={dec['tries']}")
+            await asyncio.sleep(cfg.IMAGE_CHECK_INTERVAL)
+
+    def stop(self):
+        if self._own_pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.camera.stop()
+
+
+# --- Engine ---
+
+class Session:
+    """One robot's conversation: devices in, stages wired together, run() until cancelled."""
+
+    def __init__(self, cfg, rt, mic, speakers, tracker, camera=None, scene=None, encoder=None,
+                 pool=None):
+        self.cfg = cfg
+        self.rt = rt
+        self.state = SessionState()
+        self.timeline = TurnTimeline(cfg.LATENCY_LOG)
+        self.reconnects = 0
+        self.echo = None
+        if cfg.FULL_DUPLEX:
+            if aec.available():
+                self.echo = aec.EchoCanceller(cfg.AUDIO_RATE)
+                print("Full duplex: AEC on (half duplex until it converges)")
+            else:
+                print("Full duplex: off (NumPy not installed)")
+        state = self.state
+        self.context = ContextKeeper(cfg, state, rt)
+        self.playout = Playout(
+            cfg, state, rt,
+            PcmRing(cfg.AUDIO_BUF_MAX_BYTES, overflow=cfg.AUDIO_BUF_OVERFLOW),
+            PlayoutScheduler(
+                cfg.AUDIO_RATE * cfg.S16LE_BYTES, cfg.PREBUFFER_BYTES,
+                cfg.PREBUFFER_MIN_BYTES, cfg.PREBUFFER_MAX_BYTES,
+                lead_sec=cfg.PLAYOUT_LEAD_SEC, chunk_bytes=cfg.SPEAKER_CHUNK_BYTES),
+            speakers, tracker, self.timeline, echo=self.echo)
+        self.mic = MicUplink(cfg, state, rt, mic, echo=self.echo)
+        self.greeter = Greeter(cfg, state, rt, self.playout, self.context)
+        self.idle = IdleMonitor(cfg, state, rt)
+        self.vision = None
+        if camera:
+            self.vision = VisionInjector(cfg, state, rt, self.context, camera, scene, encoder, pool)
+
+        # The stages only call each other through these
+        self.playout.on_audio = self.greeter.capture
+        self.playout.on_drained = self.mic.reopen
+        self.playout.mic_stats = self.mic.stats
+        self.mic.on_barge_in = self.playout.barge_in
+        self.mic.on_idle_chunk = self.idle.listen
+        self.idle.on_sleep = self.mic.held.clear
+        if self.vision:
+            self.idle.on_wake = self.vision.reset  # let the model see who showed up
+            self.vision.on_change = lambda: self.greeter.greet("camera")
+            self.vision.on_idle_change = lambda: self.idle.wake("camera")
+            self.vision.on_idle_hint = self.idle.prewarm
+
+        # Handlers run in this order for each event
+        rt.on("input_audio_buffer.speech_started", self.on_speech_started)
+        rt.on("input_audio_buffer.speech_stopped", self.on_speech_stopped)
+        rt.on("response.audio_transcript.delta", self.on_transcript_delta)
+        rt.on("response.audio_transcript.done", self.on_transcript_done)
+        rt.on("conversation.item.input_audio_transcription.completed", self.on_user_transcript)
+        rt.on("error", self.on_error)
+        self.context.register(rt)
+        self.greeter.register(rt)
+        self.playout.register(rt)
+
+    # --- Server events the engine itself handles ---
+
+    async def on_speech_started(self, msg):
+        print("[Listening]")
+        self.state.last_speech = time.monotonic()
+
+    async def on_speech_stopped(self, msg):
+        print("[Processing...]")
+        self.timeline.begin_turn()
+
+    async def on_transcript_delta(self, msg):
+        print(msg.get("delta", ""), end="", flush=True)
+
+    async def on_transcript_done(self, msg):
+        print()
+
+    async def on_user_transcript(self, msg):
+        print(f"You: {msg.get('transcript', '')}")
+
+    async def on_error(self, msg):
+        print(f"ERROR: {msg.get('error', {}).get('message', '?')}")
+
+    # --- Session (the only part that reconnects) ---
+
+    def reset_session(self):
+        # The server side of the conversation is gone: stop the reply
+        # it was giving and start the next session from a clean slate
+        state = self.state
+        self.playout.reset()
+        self.mic.reset()
+        self.context.reset()
+        if self.vision:
+            self.vision.reset()
+        state.prebuffered = False
+        state.response_active = False
+        state.mic_on = True
+        state.last_speech = time.monotonic()
+
+    async def sessions(self, first_conn=None, on_ready=None):
+        state, rt, idle = self.state, self.rt, self.idle
+        dropped_at = None
+        recovery_ms_max = 0.0
+        while state.running:
+            resumed = state.idle
+            if state.idle:
+                await idle.woken.wait()
+            warm = idle.take_warm() if resumed else None
+            if first_conn:
+                # Handshake started alongside device bring-up
+                sock, failed = await first_conn
+                first_conn = None
+            elif warm:
+                # Handshake started on the first hint, before the wake
+                sock, failed = await warm
+            else:
+                print("Connecting...")
+                sock, failed = await rt.connect()
+            rt.attach(sock)
+            try:
+                # Session config is re-sent on every connect
+                await rt.ws.send(rt.session_update)
+                if dropped_at is None:
+                    print("Connected to OpenAI Realtime")
+                    print(f"Session configured - Voice: {self.cfg.VOICE}")
+                    if on_ready:
+                        on_ready()
+                    print("Speak to start. Ctrl+C to quit.\n")
+                elif resumed:
+                    print(f"[Resumed] session ready {(time.monotonic() - idle.woke_at) * 1000:.0f}ms "
+                          f"after wake ({idle.summary()})")
+                else:
+                    self.reconnects += 1
+                    recovery_ms = (time.monotonic() - dropped_at) * 1000.0
+                    recovery_ms_max = max(recovery_ms_max, recovery_ms)
+                    print(f"[Reconnected] recovery={recovery_ms:.0f}ms failed_attempts={failed} "
+                          f"reconnects={self.reconnects} max={recovery_ms_max:.0f}ms")
+                await self.mic.replay_held()
+                await rt.recv(state)
+            except websockets.exceptions.ConnectionClosed:
+                print("Connection closed")
+            finally:
+                rt.ws = None
+                await sock.close()
+            dropped_at = time.monotonic()
+            self.reset_session()
+
+    async def run(self, first_conn=None, on_ready=None):
+        """All stages until cancelled; first_conn is an already started rt.connect()."""
+        stages = [self.greeter.load(), self.playout.feeder(), self.mic.run()]
+        if self.vision:
+            stages.append(self.vision.run())
+        stages += [self.context.janitor(), self.idle.watch(), self.sessions(first_conn, on_ready)]
+        await asyncio.gather(*(asyncio.create_task(s) for s in stages))
+
+    def close(self):
+        self.state.running = False
+        try:
+            if self.idle.detector:
+                print(f"[Presence] {self.idle.summary()}")
+        except Exception:
+            pass
+        self.idle.drop_warm()
+        try:
+            self.timeline.close()
+        except Exception:
+            pass
+        if self.vision:
+            try:
+                self.vision.stop()
+            except Exception:
+                pass
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Speaker fan-out - one pacat and one writer thread per USB sink
+- The event loop only enqueues; pipe writes happen off-loop
+- Each sink has a bounded queue; a slow sink drops its oldest chunks
+- Dead pacat processes are respawned by the sink's own thread
+- Optional on_played(sink, tag) callback once a tagged chunk hits the pipe
+- Estimates each sink's remaining playout from bytes written vs. wall clock
+- spawn is the backend: pacat here, pulse.spawn_playback in-process; a
+  backend that reports latency_ms/underflows has them in stats()
+- With a latency-reporting backend each sink's clock drift is estimated and,
+  if enabled, followed by single-sample inserts/drops (drift.py)
+- Optional fixed delay per sink, as silence ahead of each run of audio, to
+  line speakers up acoustically
+"""
+
+import queue
+import subprocess
+import threading
+import time
+
+import drift
+
+SINK_QUEUE_CHUNKS = 4       # 200ms of 50ms chunks before a sink drops
+RESPAWN_INTERVAL = 1.0      # min seconds between pacat respawns per sink
+PACAT_LATENCY_MSEC = 50
+BYTES_PER_SEC = 24000 * 2
+
+
+def find_usb_sinks():
+    """Find all USB audio PulseAudio sinks."""
+    try:
+        out = subprocess.check_output(["pactl", "list", "sinks", "short"], text=True)
+    except Exception:
+        return []
+    sinks = []
+    for line in out.strip().splitlines():
+        parts = line.split("\t")
+        if len(parts) >= 2 and "usb" in parts[1].lower():
+            sinks.append(parts[1])
+    return sinks
+
+
+def spawn_pacat(sink, rate=24000, latency_msec=PACAT_LATENCY_MSEC):
+    """Start a pacat playback process reading s16le mono from stdin."""
+    return subprocess.Popen(
+        ["pacat", "--playback", "--device", sink,
+         "--format=s16le", "--channels=1", f"--rate={rate}",
+         f"--latency-msec={latency_msec}"],
+        stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+
+class SinkWriter:
+    """Feeds one pacat from a bounded queue on a dedicated thread."""
+
+    def __init__(self, sink, max_chunks=SINK_QUEUE_CHUNKS, spawn=spawn_pacat,
+                 on_played=None, delay_ms=0, correct_drift=False):
+        self.sink = sink
+        self._spawn = spawn
+        self._on_played = on_played
+        self.delay_bytes = BYTES_PER_SEC * delay_ms // 1000 // 2 * 2
+        self.correct_drift = correct_drift
+        self.drift = drift.DriftEstimator(BYTES_PER_SEC)
+        self._written = 0        # bytes into the current stream
+        self._underflows_seen = 0
+        self._frac = 0.0         # correction owed, in samples
+        self._q = queue.Queue(maxsize=max_chunks)
+        self._proc = None
+        self._thread = None
+        self._running = False
+        self._last_spawn = 0.0
+        self._play_end = 0.0     # monotonic time the written audio runs out
+
+        self.chunks = 0
+        self.dropped = 0
+        self.respawns = 0
+        self.errors = 0
+        self.underflows = 0      # from streams since replaced
+        self.inserted = 0        # samples added/dropped to follow the sink clock
+        self.deleted = 0
+        self.write_ms = 0.0      # EWMA
+        self.write_ms_max = 0.0
+
+    def start(self):
+        self._proc = self._spawn(self.sink)
+        self._last_spawn = time.monotonic()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"sink-{self.sink}", daemon=True)
+        self._thread.start()
+
+    def put(self, data, tag=None):
+        """Enqueue a chunk without blocking; evicts the oldest when full."""
+        item = (data, tag)
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            try:
+                self._q.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped += 1
+            try:
+                self._q.put_nowait(item)
+            except queue.Full:
+                pass
+
+    def flush(self):
+        """Drop everything queued for this sink (e.g. on barge-in)."""
+        while True:
+            try:
+                self._q.get_nowait()
+            except queue.Empty:
+                break
+
+    def _respawn(self):
+        now = time.monotonic()
+        if now - self._last_spawn < RESPAWN_INTERVAL:
+            return
+        self._last_spawn = now
+        self.underflows += getattr(self._proc, "underflows", 0)
+        self._written = 0
+        self._underflows_seen = 0
+        self.drift.restart()
+        try:
+            self._proc = self._spawn(self.sink)
+            self.respawns += 1
+            print(f"[Speaker respawned: {self.sink}]")
+        except Exception:
+            self.errors += 1
+
+    def _run(self):
+        while self._running:
+            try:
+                item = self._q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            data, tag = item
+            p = self._proc
+            if p is None or p.poll() is not None:
+                self._respawn()
+                self.dropped += 1
+                continue
+            t0 = time.monotonic()
+            data = self._retime(data, fresh=self._play_end <= t0)
+            try:
+                p.stdin.write(data)
+                p.stdin.flush()
+            except Exception:
+                self.errors += 1
+                continue
+            t1 = time.monotonic()
+            self._play_end = max(self._play_end, t1) + len(data) / BYTES_PER_SEC
+            self._written += len(data)
+            latency = getattr(p, "latency_ms", None)
+            if latency is not None:
+                underflows = getattr(p, "underflows", 0)
+                if underflows != self._underflows_seen:
+                    # The stream stalled mid-run: consumption is no longer the sink clock
+                    self._underflows_seen = underflows
+                    self.drift.restart()
+                self.drift.add(t1, self._written - latency / 1000.0 * BYTES_PER_SEC)
+            ms = (t1 - t0) * 1000.0
+            self.write_ms += (ms - self.write_ms) / 16
+            if ms > self.write_ms_max:
+                self.write_ms_max = ms
+            self.chunks += 1
+            if tag and self._on_played:
+                self._on_played(self.sink, tag)
+
+    def _retime(self, data, fresh):
+        """Drift correction and alignment delay for the next chunk."""
+        if fresh:
+            # Playback had drained: a new run for the estimator, and the
+            # sink's fixed delay goes in front of it
+            self.drift.restart()
+        ppm = self.drift.ppm if self.correct_drift else None
+        if ppm:
+            self._frac += len(data) // 2 * ppm / 1e6
+            n = int(self._frac)
+            if n:
+                data = drift.adjust(data, n)
+                self._frac -= n
+                if n > 0:
+                    self.inserted += n
+                else:
+                    self.deleted -= n
+        if fresh and self.delay_bytes:
+            data = bytes(self.delay_bytes) + data
+        return data
+
+    def stop(self):
+        self._running = False
+        try:
+            self._q.put_nowait(None)
+        except queue.Full:
+            pass
+        try:
+            self._proc.kill()
+        except Exception:
+            pass
+
+    @property
+    def depth(self):
+        return self._q.qsize()
+
+    def remaining_sec(self, now=None):
+        """Seconds until this sink goes quiet: queued + unplayed + pacat latency."""
+        now = time.monotonic() if now is None else now
+        with self._q.mutex:
+            queued = sum(len(item[0]) for item in self._q.queue if item)
+        if not queued and self._play_end + PACAT_LATENCY_MSEC / 1000.0 <= now:
+            return 0.0
+        end = max(self._play_end, now) + queued / BYTES_PER_SEC
+        return end + PACAT_LATENCY_MSEC / 1000.0 - now
+
+    def stats(self):
+        p = self._proc
+        latency = getattr(p, "latency_ms", None)
+        ppm = self.drift.ppm
+        if latency is not None:
+            with self._q.mutex:
+                queued = sum(len(item[0]) for item in self._q.queue if item)
+            fill_ms = latency + queued * 1000.0 / BYTES_PER_SEC
+        else:
+            fill_ms = self.remaining_sec() * 1000.0
+        return {
+            "depth": self.depth,
+            "chunks": self.chunks,
+            "dropped": self.dropped,
+            "respawns": self.respawns,
+            "errors": self.errors,
+            "write_ms": round(self.write_ms, 2),
+            "write_ms_max": round(self.write_ms_max, 2),
+            "latency_ms": None if latency is None else round(latency, 1),
+            "underflows": self.underflows + getattr(p, "underflows", 0),
+            "fill_ms": round(fill_ms, 1),
+            "drift_ppm": None if ppm is None else round(ppm, 1),
+            "inserted": self.inserted,
+            "deleted": self.deleted,
+        }
+
+
+class SpeakerFanout:
+    """Non-blocking fan-out of PCM chunks to every sink's writer."""
+
+    def __init__(self, sinks, max_chunks=SINK_QUEUE_CHUNKS, spawn=spawn_pacat,
+                 on_played=None, delays_ms=None, correct_drift=False):
+        delays_ms = delays_ms or {}
+        self.writers = [SinkWriter(s, max_chunks, spawn, on_played, delays_ms.get(s, 0), correct_drift)
+                        for s in sinks]
+
+    def start(self):
+        for w in self.writers:
+            w.start()
+            print(f"Speaker pipe: {w.sink}")
+
+    def write(self, data, tag=None):
+        # One immutable copy shared by all sinks; callers may pass a view
+        # into a buffer that is about to be reused.
+        chunk = bytes(data)
+        for w in self.writers:
+            w.put(chunk, tag)
+
+    def flush(self):
+        for w in self.writers:
+            w.flush()
+
+    def stop(self):
+        for w in self.writers:
+            w.stop()
+
+    def remaining_sec(self):
+        """Seconds until every sink has played out what it was given."""
+        now = time.monotonic()
+        return max((w.remaining_sec(now) for w in self.writers), default=0.0)
+
+    def stats(self):
+        return {w.sink: w.stats() for w in self.writers}
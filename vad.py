@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Local voice-activity gate in front of the Realtime API upload
+- EnergyVad: NumPy RMS energy over an adaptive noise floor + zero-crossing rate
+- Any callable taking a PCM chunk and returning bool can be plugged in instead
+- VadGate keeps a pre-roll so speech onsets reach the server intact, and a
+  hangover so server VAD still hears the trailing silence it needs
+"""
+
+import math
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:  # voice-only installs may not have NumPy
+    np = None
+
+
+def available():
+    return np is not None
+
+
+class EnergyVad:
+    """Energy/zero-crossing speech detector for s16le mono chunks."""
+
+    def __init__(self, margin_db=9.0, min_db=-50.0, zcr_max=0.35,
+                 floor_db=-60.0, attack=0.05, drift=0.002):
+        if np is None:
+            raise RuntimeError("EnergyVad needs NumPy")
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.zcr_max = zcr_max
+        self.noise_db = floor_db
+        self.attack = attack
+        self.drift = drift
+
+    def __call__(self, pcm):
+        x = np.frombuffer(pcm, dtype="<i2").astype(np.float32)
+        if not len(x):
+            return False
+        rms = float(np.sqrt(np.mean(x * x))) / 32768.0
+        db = 20.0 * math.log10(rms + 1e-9)
+        zcr = float(np.count_nonzero(np.diff(np.signbit(x)))) / len(x)
+        speech = db > max(self.min_db, self.noise_db + self.margin_db) and zcr < self.zcr_max
+        # Track the noise floor on silence; creep toward loud rooms anyway so
+        # a sustained crowd level does not read as speech forever.
+        self.noise_db += (self.drift if speech else self.attack) * (db - self.noise_db)
+        return speech
+
+
+class VadGate:
+    """Decides which mic chunks are worth uploading."""
+
+    def __init__(self, detector, chunk_ms, preroll_ms=300, hangover_ms=1000):
+        self.detector = detector
+        self._preroll = deque(maxlen=max(1, math.ceil(preroll_ms / chunk_ms)))
+        self._hang_chunks = math.ceil(hangover_ms / chunk_ms)
+        self._hang = 0
+        self.chunks_in = 0
+        self.chunks_sent = 0
+
+    def process(self, chunk):
+        """Returns the bytes to upload for this chunk (with pre-roll), or None."""
+        self.chunks_in += 1
+        if self.detector(chunk):
+            self._hang = self._hang_chunks
+        elif self._hang > 0:
+            self._hang -= 1
+        else:
+            self._preroll.append(bytes(chunk))
+            return None
+        parts = list(self._preroll)
+        parts.append(chunk)
+        self._preroll.clear()
+        self.chunks_sent += len(parts)
+        return b"".join(parts)
+
+    def reset(self):
+        self._preroll.clear()
+        self._hang = 0
+
+    @property
+    def reduction(self):
+        """Fraction of mic chunks that were not uploaded."""
+        if not self.chunks_in:
+            return 0.0
+        return 1.0 - self.chunks_sent / self.chunks_in
+
+    def stats(self):
+        return {
+            "chunks_in": self.chunks_in,
+            "chunks_sent": self.chunks_sent,
+            "reduction": round(self.reduction, 3),
+        }